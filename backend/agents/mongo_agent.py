@@ -2,27 +2,27 @@
 
 from db.mongo_conn import get_mongo_collection
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
+from services.llm_client import get_chat_model
+from services.tracing import stage, record_query, record_rows, mark_failed
+from services.entity_index import entity_index, load_clients
 from dotenv import load_dotenv
-import os
 import ast
 import json
+import logging
 import time
 import re
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
 # COMPLETELY DISABLE REAL MONGODB - ALWAYS USE MOCK DATA
 MONGODB_AVAILABLE = False
 collection = None
-print("🔧 Using mock data mode for all MongoDB queries - Real MongoDB disabled")
+logger.info("Using mock data mode for all MongoDB queries - real MongoDB disabled")
 
 # Setup LLM
-llm = ChatOpenAI(
-    model="gpt-3.5-turbo",
-    temperature=0,
-    api_key=os.getenv("OPENAI_API_KEY")
-)
+llm = get_chat_model()
 
 template = """
 You are a MongoDB query generator for a client portfolio database.
@@ -56,16 +56,41 @@ MongoDB Query:"""
 
 prompt = PromptTemplate.from_template(template)
 
+# Enhanced mock client data with portfolio values and RM info
+MOCK_CLIENTS = [
+    {"name": "Virat Kohli", "client_id": "C001", "risk_appetite": "High", "investment_preferences": ["Stocks", "Real Estate"], "portfolio_value": 5000000, "rm_id": "RM001"},
+    {"name": "Rohit Sharma", "client_id": "C002", "risk_appetite": "Medium", "investment_preferences": ["Stocks", "Bonds"], "portfolio_value": 3500000, "rm_id": "RM002"},
+    {"name": "MS Dhoni", "client_id": "C003", "risk_appetite": "Low", "investment_preferences": ["Bonds", "Fixed Deposits"], "portfolio_value": 2000000, "rm_id": "RM003"},
+    {"name": "KL Rahul", "client_id": "C004", "risk_appetite": "High", "investment_preferences": ["Stocks", "Real Estate", "Crypto"], "portfolio_value": 4500000, "rm_id": "RM001"},
+    {"name": "Rishabh Pant", "client_id": "C005", "risk_appetite": "Medium", "investment_preferences": ["Stocks", "Mutual Funds"], "portfolio_value": 3000000, "rm_id": "RM002"},
+    {"name": "Hardik Pandya", "client_id": "C006", "risk_appetite": "High", "investment_preferences": ["Stocks", "Real Estate"], "portfolio_value": 4000000, "rm_id": "RM001"},
+    {"name": "Deepika Padukone", "client_id": "C007", "risk_appetite": "Medium", "investment_preferences": ["Stocks", "Bonds"], "portfolio_value": 2800000, "rm_id": "RM003"},
+    {"name": "Salman Khan", "client_id": "C008", "risk_appetite": "High", "investment_preferences": ["Real Estate", "Stocks"], "portfolio_value": 6000000, "rm_id": "RM001"},
+    {"name": "Shah Rukh Khan", "client_id": "C009", "risk_appetite": "High", "investment_preferences": ["Stocks", "Real Estate"], "portfolio_value": 5500000, "rm_id": "RM002"},
+    {"name": "Dinesh Karthik", "client_id": "C010", "risk_appetite": "Medium", "investment_preferences": ["Stocks", "Mutual Funds"], "portfolio_value": 2500000, "rm_id": "RM003"}
+]
+MOCK_CLIENTS_BY_ID = {c['client_id']: c for c in MOCK_CLIENTS}
+# Client names resolve from import on, without the app's startup refresh (scripts, replay CLI)
+load_clients(entity_index, MOCK_CLIENTS)
+
+CLIENT_ID_PATTERN = re.compile(r'\b(c\d{3,})\b', re.IGNORECASE)
+
 def query_mongo(question: str):
     start = time.time()
 
     try:
         # ALWAYS use mock responses - force mock mode
-        print(f"🔧 Processing query with mock data: {question}")
-        return get_mock_response(question, start)
+        logger.debug(f"Processing query with mock data: {question}")
+        with stage("entities"):
+            entities = entity_index.extract(question)
+        with stage("mongo.query"):
+            response = get_mock_response(question, start, entities)
+        record_query(create_simple_query(question), response.get("answer"))
+        return response
         
     except Exception as e:
-        print(f"❌ Error in mock response: {str(e)}")
+        logger.error(f"Error in mock response: {str(e)}")
+        mark_failed("mongo_query")
         return {
             "answer": f"Error processing query: {str(e)}",
             "query": question,
@@ -119,36 +144,29 @@ def parse_question(question: str):
     
     return parsed
 
-def get_mock_response(question: str, start_time: float):
+def get_mock_response(question: str, start_time: float, entities=None):
     """Provide mock responses when MongoDB is not available"""
     question_lower = question.lower()
+    if entities is None:
+        entities = entity_index.extract(question)
+    client_entities = [e for e in entities if e['kind'] == 'client']
     
-    # Enhanced mock client data with portfolio values and RM info
-    mock_clients = [
-        {"name": "Virat Kohli", "client_id": "C001", "risk_appetite": "High", "investment_preferences": ["Stocks", "Real Estate"], "portfolio_value": 5000000, "rm_id": "RM001"},
-        {"name": "Rohit Sharma", "client_id": "C002", "risk_appetite": "Medium", "investment_preferences": ["Stocks", "Bonds"], "portfolio_value": 3500000, "rm_id": "RM002"},
-        {"name": "MS Dhoni", "client_id": "C003", "risk_appetite": "Low", "investment_preferences": ["Bonds", "Fixed Deposits"], "portfolio_value": 2000000, "rm_id": "RM003"},
-        {"name": "KL Rahul", "client_id": "C004", "risk_appetite": "High", "investment_preferences": ["Stocks", "Real Estate", "Crypto"], "portfolio_value": 4500000, "rm_id": "RM001"},
-        {"name": "Rishabh Pant", "client_id": "C005", "risk_appetite": "Medium", "investment_preferences": ["Stocks", "Mutual Funds"], "portfolio_value": 3000000, "rm_id": "RM002"},
-        {"name": "Hardik Pandya", "client_id": "C006", "risk_appetite": "High", "investment_preferences": ["Stocks", "Real Estate"], "portfolio_value": 4000000, "rm_id": "RM001"},
-        {"name": "Deepika Padukone", "client_id": "C007", "risk_appetite": "Medium", "investment_preferences": ["Stocks", "Bonds"], "portfolio_value": 2800000, "rm_id": "RM003"},
-        {"name": "Salman Khan", "client_id": "C008", "risk_appetite": "High", "investment_preferences": ["Real Estate", "Stocks"], "portfolio_value": 6000000, "rm_id": "RM001"},
-        {"name": "Shah Rukh Khan", "client_id": "C009", "risk_appetite": "High", "investment_preferences": ["Stocks", "Real Estate"], "portfolio_value": 5500000, "rm_id": "RM002"},
-        {"name": "Dinesh Karthik", "client_id": "C010", "risk_appetite": "Medium", "investment_preferences": ["Stocks", "Mutual Funds"], "portfolio_value": 2500000, "rm_id": "RM003"}
-    ]
+    mock_clients = MOCK_CLIENTS
     
     # Parse the question
     parsed_query = parse_question(question)
     
     # Handle specific client ID queries
-    client_id_match = re.search(r'client\s+([A-Z]\d+)', question_lower)
-    if not client_id_match:
-        client_id_match = re.search(r'([A-Z]\d+)', question_lower)
+    id_mentions = [e['value'] for e in client_entities if e['text'].lower() == e['value'].lower()]
+    if not id_mentions:
+        # Not an indexed client, but still answer "not found" for ID-shaped tokens
+        id_mentions = [m.upper() for m in CLIENT_ID_PATTERN.findall(question)]
     
-    if client_id_match:
-        client_id = client_id_match.group(1)
-        client = next((c for c in mock_clients if c['client_id'] == client_id), None)
+    if id_mentions:
+        client_id = id_mentions[0]
+        client = MOCK_CLIENTS_BY_ID.get(client_id)
         if client:
+            record_rows([client])
             answer = f"Client {client_id} is {client['name']} (Risk: {client['risk_appetite']}, Portfolio: ₹{client['portfolio_value']:,})"
         else:
             answer = f"Client {client_id} not found in the database."
@@ -160,9 +178,11 @@ def get_mock_response(question: str, start_time: float):
     
     # Handle "who is" queries for specific names
     if 'who is' in question_lower:
-        # Extract potential names from the question
-        for client in mock_clients:
-            if client['name'].lower() in question_lower:
+        # Names resolved by the entity index map straight to a client id
+        for entity in client_entities:
+            client = MOCK_CLIENTS_BY_ID.get(entity['value'])
+            if client:
+                record_rows([client])
                 answer = f"{client['name']} is Client {client['client_id']} (Risk: {client['risk_appetite']}, Portfolio: ₹{client['portfolio_value']:,})"
                 return {
                     "answer": answer,
@@ -175,6 +195,7 @@ def get_mock_response(question: str, start_time: float):
         limit = parsed_query['limit'] or 5
         sorted_clients = sorted(mock_clients, key=lambda x: x['portfolio_value'], reverse=True)
         top_clients = sorted_clients[:limit]
+        record_rows(top_clients)
         client_info = [f"• {c['name']} (Portfolio: ₹{c['portfolio_value']:,})" for c in top_clients]
         answer = f"Top {limit} investors:\n" + "\n".join(client_info)
         return {
@@ -195,6 +216,7 @@ def get_mock_response(question: str, start_time: float):
         sorted_rms = sorted(rm_groups.items(), key=lambda x: x[1], reverse=True)
         limit = parsed_query['limit'] or 5
         top_rms = sorted_rms[:limit]
+        record_rows([{"rm_id": rm_id, "portfolio_value": total} for rm_id, total in top_rms])
         rm_info = [f"• {rm_id} (Total Portfolio: ₹{total:,})" for rm_id, total in top_rms]
         answer = f"Top {limit} relationship managers:\n" + "\n".join(rm_info)
         return {
@@ -213,6 +235,7 @@ def get_mock_response(question: str, start_time: float):
                 rm_groups[rm_id] = 0
             rm_groups[rm_id] += client['portfolio_value']
         rm_info = [f"• {rm_id}: ₹{total:,}" for rm_id, total in rm_groups.items()]
+        record_rows([{"rm_id": rm_id, "portfolio_value": total} for rm_id, total in rm_groups.items()])
         answer = f"Portfolio value breakup per relationship manager:\n" + "\n".join(rm_info)
         return {
             "answer": answer,
@@ -253,6 +276,8 @@ def get_mock_response(question: str, start_time: float):
     if parsed_query['limit']:
         filtered_clients = filtered_clients[:parsed_query['limit']]
     
+    record_rows(filtered_clients)
+    
     # Format response
     if parsed_query['names_only']:
         names = [f"• {c['name']}" for c in filtered_clients]
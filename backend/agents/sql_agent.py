@@ -1,4 +1,3 @@
-from langchain_openai import ChatOpenAI
 from langchain_community.utilities import SQLDatabase
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
@@ -11,6 +10,12 @@ import re
 import logging
 import traceback
 from typing import Optional, Dict, Any
+from db.sql_guard import GuardedSQLDatabase
+from services.llm_client import get_chat_model
+from services.tracing import stage, record_query, mark_failed
+from services.entity_index import entity_index, bind_parameters, describe_parameters
+from services import holdings
+from services.examples import example_store, format_examples
 
 # Suppress LangSmith warnings
 warnings.filterwarnings('ignore', category=UserWarning, module='langsmith')
@@ -35,14 +40,10 @@ class SQLQueryAgent:
     
     def __init__(self):
         try:
-            self.db = SQLDatabase.from_uri(mysql_uri)
-            self.llm = ChatOpenAI(
-                model="gpt-3.5-turbo", 
-                temperature=0, 
-                api_key=openai_api_key,
-                max_tokens=1500,
-                timeout=30  # Add timeout
-            )
+            # Generated SQL is vetted (read-only, EXPLAIN cost, timeout) before it runs
+            self.db = GuardedSQLDatabase.from_uri(mysql_uri)
+            # Shared pooled client with retries, deadline and concurrency limit
+            self.llm = get_chat_model(max_tokens=1500)
             self.agent = None
             self.schema_info = None
             self._init_schema_info()
@@ -88,6 +89,9 @@ IMPORTANT RULES:
 9. For sorting by amount, use ORDER BY amount_invested DESC
 10. Always prioritize showing names over IDs when possible
 
+Verified queries for similar questions (adapt them, don't copy blindly):
+{examples}
+
 Use this format:
 Question: the input question you must answer
 Thought: you should always think about what to do
@@ -100,7 +104,7 @@ Final Answer: the final answer to the original input question
 
 Question: {input}
 Thought:{agent_scratchpad}""",
-                input_variables=["input", "agent_scratchpad"],
+                input_variables=["input", "examples", "agent_scratchpad"],
                 partial_variables={
                     "schema": self.schema_info or "Schema not available",
                     "tools": "\n".join([f"{tool.name}: {tool.description}" for tool in tools]),
@@ -115,7 +119,7 @@ Thought:{agent_scratchpad}""",
             self.agent = AgentExecutor(
                 agent=agent,
                 tools=tools,
-                verbose=True,
+                verbose=False,
                 handle_parsing_errors=True,
                 max_iterations=5,  # Increased iterations
                 max_execution_time=60,  # Added timeout
@@ -141,8 +145,15 @@ Thought:{agent_scratchpad}""",
         # Try agent first
         if self.agent:
             try:
-                response = self.agent.invoke({"input": question})
+                agent_input = question
+                if parsed_query['entities']:
+                    agent_input += f"\n\nResolved entities (filter on these exact values): {describe_parameters(parsed_query['entities'])}"
+                with stage("examples.search"):
+                    examples = format_examples(example_store.search(question))
+                with stage("llm.agent"):
+                    response = self.agent.invoke({"input": agent_input, "examples": examples or "None"})
                 output = response.get('output', 'No output found')
+                self._record_agent_query(response, question)
                 
                 # Check if the response is meaningful
                 if output and len(output.strip()) > 10 and "Agent stopped" not in output:
@@ -157,6 +168,25 @@ Thought:{agent_scratchpad}""",
         # Fallback to direct SQL generation
         return self._direct_sql_query(question, parsed_query)
     
+    def _record_agent_query(self, response: dict, question: str):
+        """Record the last SQL the agent ran through the query tool"""
+        for action, observation in reversed(response.get('intermediate_steps', [])):
+            if getattr(action, 'tool', None) == 'sql_db_query':
+                record_query(action.tool_input, observation)
+                self._learn_example(question, action.tool_input, observation)
+                break
+
+    def _learn_example(self, question: str, sql_query: str, result: Any):
+        """Keep a question/SQL pair as a few-shot example once it returned rows"""
+        result = str(result or "").strip()
+        if not result or result.startswith(("Error", "Query execution failed")):
+            return
+        try:
+            # Store what actually ran: the guard repaired identifiers before execution
+            example_store.learn(question, self.db.repairer.repair_sql(sql_query, dialect=self.db.dialect))
+        except Exception as e:
+            logger.error(f"Failed to learn SQL example: {str(e)}")
+    
     def _parse_question(self, question: str):
         """Parse the question to extract specific requirements"""
         question_lower = question.lower()
@@ -167,7 +197,9 @@ Thought:{agent_scratchpad}""",
             'sort_order': 'DESC',
             'top_n': False,
             'names_only': False,
-            'amount_focus': False
+            'amount_focus': False,
+            # {column: [canonical values]} for clients, RMs and stocks named in the question
+            'entities': bind_parameters(entity_index.extract(question))
         }
         
         # Extract limit number
@@ -197,20 +229,27 @@ Thought:{agent_scratchpad}""",
         """Enhanced direct SQL query generation and execution"""
         try:
             # Generate SQL query
-            sql_query = self._generate_sql_query(question, parsed_query)
+            with stage("llm.generate_sql"):
+                sql_query = self._generate_sql_query(question, parsed_query)
             if not sql_query:
+                mark_failed("sql_generation")
                 return "Could not generate SQL query"
             
             logger.info(f"Generated SQL: {sql_query}")
             
-            # Execute query with retry logic
-            result = self._execute_query_with_retry(sql_query, question)
+            # Execute query (the guard has already repaired identifiers)
+            with stage("db.execute"):
+                result = self._execute_query(sql_query)
+            record_query(sql_query, result)
+            self._learn_example(question, sql_query, result)
             
             # Format and return response
-            return self._format_response(question, sql_query, result, parsed_query)
+            with stage("llm.format"):
+                return self._format_response(question, sql_query, result, parsed_query)
                 
         except Exception as e:
             logger.error(f"Error in SQL handler: {str(e)}")
+            mark_failed("sql_handler")
             return f"Error in SQL handler: {str(e)}"
     
     def _generate_sql_query(self, question: str, parsed_query: dict) -> Optional[str]:
@@ -223,6 +262,12 @@ Thought:{agent_scratchpad}""",
             if parsed_query['sort_by']:
                 order_clause = f" ORDER BY {parsed_query['sort_by']} {parsed_query['sort_order']}"
             
+            examples = format_examples(example_store.search(question))
+            examples_block = f"""
+Verified queries for similar questions (adapt them, don't copy blindly):
+{examples}
+""" if examples else ""
+            
             sql_prompt = f"""
 Based on this MySQL database schema:
 {self.schema_info}
@@ -243,7 +288,8 @@ Additional Requirements:
 - Limit: {parsed_query['limit'] or 'None'}
 - Sort by: {parsed_query['sort_by'] or 'None'}
 - Sort order: {parsed_query['sort_order']}
-
+- Entity filters (use these exact values): {describe_parameters(parsed_query['entities']) or 'None'}
+{examples_block}
 SQL Query:"""
             
             response = self.llm.invoke(sql_prompt)
@@ -274,8 +320,13 @@ SQL Query:"""
             
         return sql_query
     
-    def _execute_query_with_retry(self, sql_query: str, question: str) -> str:
-        """Execute query with error handling and retry logic"""
+    def _execute_query(self, sql_query: str) -> str:
+        """Execute a generated query.
+
+        GuardedSQLDatabase repairs identifiers against the schema before the
+        first execution, so an "Unknown column" error here is not something
+        a second repair pass could fix.
+        """
         try:
             result = self.db.run(sql_query)
             logger.info(f"Raw Result: {result}")
@@ -284,40 +335,9 @@ SQL Query:"""
         except Exception as query_error:
             error_msg = str(query_error)
             logger.error(f"Query error: {error_msg}")
-            
-            # Try to fix common errors
-            if "Unknown column" in error_msg:
-                # Try to fix column name issues
-                corrected_query = self._fix_column_names(sql_query)
-                if corrected_query != sql_query:
-                    logger.info(f"Retrying with corrected query: {corrected_query}")
-                    try:
-                        result = self.db.run(corrected_query)
-                        logger.info(f"Retry Result: {result}")
-                        return result
-                    except Exception as retry_error:
-                        logger.error(f"Retry failed: {str(retry_error)}")
-            
+            mark_failed("query_execution")
             return f"Query execution failed: {error_msg}"
     
-    def _fix_column_names(self, sql_query: str) -> str:
-        """Fix common column name issues"""
-        # Common column name fixes
-        replacements = {
-            'transactoin_id': 'transaction_id',  # Fix the typo in the database
-            'amount': 'amount_invested',
-            'transaction_date': 'date_',
-            'date': 'date_',
-            'rm': 'rm_name',
-            'relationship_manager': 'rm_name'
-        }
-        
-        corrected_query = sql_query
-        for wrong, correct in replacements.items():
-            corrected_query = re.sub(rf'\b{wrong}\b', correct, corrected_query, flags=re.IGNORECASE)
-        
-        return corrected_query
-    
     def _format_response(self, question: str, sql_query: str, result: str, parsed_query: dict) -> str:
         """Format the final response with enhanced parsing"""
         if "Query execution failed" in result:
@@ -423,10 +443,18 @@ def debug_database():
 def query_sql_database(question: str) -> str:
     """Main function to query the SQL database"""
     try:
-        agent = SQLQueryAgent()
+        # Running totals, period-over-period and concentration come from the
+        # in-memory holdings arrays without an LLM round trip
+        with stage("analytics.fast_path"):
+            fast_answer = holdings.answer(question)
+        if fast_answer is not None:
+            return fast_answer
+        with stage("agent.init"):
+            agent = SQLQueryAgent()
         return agent.query(question)
     except Exception as e:
         logger.error(f"Error in query_sql_database: {str(e)}")
+        mark_failed("sql_agent")
         return f"Error: {str(e)}"
 
 def get_sql_agent():
@@ -9,8 +9,14 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-def connect_mysql():
-    """Connect to MySQL with environment variables and error handling"""
+def connect_mysql(**overrides):
+    """Connect to MySQL with environment variables and error handling.
+
+    Keyword overrides are passed through to mysql.connector, e.g. a separate
+    pool for bulk loads that need allow_local_infile. An override of None
+    drops the setting, so pool_name=None, pool_size=None opens an unpooled
+    connection.
+    """
     try:
         # Get database configuration from environment variables
         host = os.getenv("MYSQL_HOST", "localhost")
@@ -21,7 +27,7 @@ def connect_mysql():
         
         logger.info(f"Connecting to MySQL: {host}:{port}/{database}")
         
-        conn = mysql.connector.connect(
+        config = dict(
             host=host,
             user=user,
             password=password,
@@ -32,6 +38,8 @@ def connect_mysql():
             pool_size=5,
             pool_name="valuefy_pool"
         )
+        config.update(overrides)
+        conn = mysql.connector.connect(**{k: v for k, v in config.items() if v is not None})
         
         logger.info("MySQL connection successful")
         return conn
@@ -69,10 +77,10 @@ def test_mysql():
         logger.error(f"MySQL test failed: {str(e)}")
         raise
 
-def get_mysql_connection():
+def get_mysql_connection(**overrides):
     """Get a MySQL connection with error handling"""
     try:
-        return connect_mysql()
+        return connect_mysql(**overrides)
     except Exception as e:
         logger.error(f"Failed to get MySQL connection: {str(e)}")
         raise
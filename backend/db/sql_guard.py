@@ -0,0 +1,213 @@
+# db/sql_guard.py
+
+import logging
+import math
+import os
+from collections import defaultdict
+from typing import Callable, List, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from langchain_community.utilities import SQLDatabase
+
+from db.sql_repair import SchemaRepairer, load_schema
+from services import metrics
+from services.tracing import record_rows, stage
+
+logger = logging.getLogger(__name__)
+
+MAX_EXECUTION_MS = int(os.getenv("SQL_MAX_EXECUTION_MS", "10000"))
+# Budget for rows a join multiplies out; plain scans are bounded by MAX_EXECUTION_MS instead
+MAX_ESTIMATED_ROWS = int(os.getenv("SQL_MAX_ESTIMATED_ROWS", "1000000"))
+DEFAULT_LIMIT = int(os.getenv("SQL_DEFAULT_LIMIT", "1000"))
+
+# Nodes that make an otherwise SELECT-shaped statement write or lock
+_FORBIDDEN_NODES = (exp.Into, exp.Lock, exp.Insert, exp.Update, exp.Delete, exp.Merge,
+                    exp.Create, exp.Drop, exp.Alter, exp.Command)
+
+
+class UnsafeQueryError(Exception):
+    """Raised when generated SQL is not a read-only query we are willing to run"""
+
+
+def parse_read_only(sql: str, dialect: str = "mysql") -> exp.Query:
+    """Parse SQL into an AST and accept only a single SELECT / set operation"""
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=dialect) if s is not None]
+    except ParseError as e:
+        raise UnsafeQueryError(f"Could not parse SQL: {str(e).splitlines()[0]}")
+
+    if len(statements) != 1:
+        raise UnsafeQueryError(f"Expected exactly one statement, got {len(statements)}")
+    tree = statements[0]
+    if not isinstance(tree, (exp.Select, exp.SetOperation)):
+        raise UnsafeQueryError(f"Only read-only SELECT queries are allowed, got {tree.key.upper()}")
+    forbidden = tree.find(*_FORBIDDEN_NODES)
+    if forbidden is not None:
+        raise UnsafeQueryError(f"Query contains a forbidden {forbidden.key.upper()} clause")
+    return tree
+
+
+def estimate_rows(plan: List[dict]) -> float:
+    """Rows MySQL expects to examine, from classic tabular EXPLAIN output.
+
+    Tables sharing a select id are joined in a nested loop, so their row
+    estimates (scaled by `filtered`) multiply; separate select ids add up.
+    """
+    per_select = defaultdict(lambda: 1.0)
+    for row in plan:
+        rows = float(row.get("rows") or 1)
+        filtered = float(row.get("filtered") or 100) / 100
+        per_select[row.get("id")] *= max(rows * filtered, 1.0)
+    return sum(per_select.values())
+
+
+def joined_rows(plan: List[dict]) -> float:
+    """Largest row product of a nested-loop join in the plan (0 when nothing is joined)"""
+    per_select = defaultdict(list)
+    for row in plan:
+        rows = float(row.get("rows") or 1)
+        filtered = float(row.get("filtered") or 100) / 100
+        per_select[row.get("id")].append(max(rows * filtered, 1.0))
+    products = [math.prod(tables) for tables in per_select.values() if len(tables) > 1]
+    return max(products, default=0.0)
+
+
+def has_cartesian_join(tree: exp.Expression) -> bool:
+    for join in tree.find_all(exp.Join):
+        if not join.args.get("on") and not join.args.get("using"):
+            return True
+    return False
+
+
+def can_stop_early(tree: exp.Expression) -> bool:
+    """True if a LIMIT lets MySQL stop scanning, i.e. rows stream straight out"""
+    if not isinstance(tree, exp.Select):
+        return False
+    if tree.args.get("group") or tree.args.get("order") or tree.args.get("distinct"):
+        return False
+    return tree.find(exp.AggFunc) is None and not has_cartesian_join(tree)
+
+
+def add_execution_time_hint(tree: exp.Expression, ms: int) -> exp.Expression:
+    """Attach /*+ MAX_EXECUTION_TIME(ms) */ to the statement's first SELECT"""
+    select = tree
+    while isinstance(select, exp.SetOperation):
+        select = select.this
+    hint = select.args.get("hint")
+    existing = [e for e in (hint.expressions if hint else [])
+                if not (isinstance(e, exp.Anonymous) and str(e.this).upper() == "MAX_EXECUTION_TIME")]
+    timeout = exp.Anonymous(this="MAX_EXECUTION_TIME", expressions=[exp.Literal.number(ms)])
+    select.set("hint", exp.Hint(expressions=existing + [timeout]))
+    return tree
+
+
+class SQLGuard:
+    """Vet generated SQL before it reaches the shared database.
+
+    Rejects anything but read-only queries, repairs identifiers against the
+    schema (see SchemaRepairer) so they work on the first try, asks EXPLAIN how many rows the
+    plan will touch, refuses cartesian or nested-loop joins that multiply out
+    past SQL_MAX_ESTIMATED_ROWS, caps result sets that stream out at
+    SQL_DEFAULT_LIMIT and adds a per-statement MAX_EXECUTION_TIME. Large
+    single-table scans (totals, per-RM breakups) are let through; the
+    execution time limit bounds them.
+    """
+
+    def __init__(self, explain: Optional[Callable[[str], List[dict]]], dialect: str = "mysql",
+                 repairer: Optional[SchemaRepairer] = None):
+        self.explain = explain
+        self.dialect = dialect
+        self.repairer = repairer
+
+    def prepare(self, sql: str, apply_limit: bool = True, max_estimated_rows: Optional[float] = None,
+                max_execution_ms: Optional[int] = None) -> str:
+        """Vet and rewrite a query; exports pass their own (larger) row and time budgets"""
+        max_estimated_rows = max_estimated_rows or MAX_ESTIMATED_ROWS
+        tree = parse_read_only(sql, self.dialect)
+        if self.repairer is not None:
+            tree = self.repairer.repair(tree)
+        plan = self._explain(tree)
+        estimated = estimate_rows(plan) if plan is not None else None
+
+        if estimated is not None and estimated > max_estimated_rows:
+            if can_stop_early(tree):
+                # Rows stream straight out, so a LIMIT stops the scan early
+                limit = self._limit_value(tree)
+                if limit is None or limit > DEFAULT_LIMIT:
+                    logger.info(f"Plan estimates {estimated:,.0f} rows, bounding with LIMIT {DEFAULT_LIMIT}")
+                    tree = tree.limit(DEFAULT_LIMIT)
+                    metrics.increment("sql_guard.limited")
+            elif has_cartesian_join(tree) or joined_rows(plan) > max_estimated_rows:
+                metrics.increment("sql_guard.rejected")
+                reason = "a cartesian join" if has_cartesian_join(tree) else "its joins"
+                raise UnsafeQueryError(
+                    f"Query refused: {reason} would examine ~{estimated:,.0f} rows "
+                    f"(limit {max_estimated_rows:,.0f}). Add filters or join conditions."
+                )
+            else:
+                metrics.increment("sql_guard.large_scan")
+        elif apply_limit and tree.args.get("limit") is None and isinstance(tree, exp.Select) \
+                and (estimated is None or estimated > DEFAULT_LIMIT) and not tree.find(exp.AggFunc):
+            tree = tree.limit(DEFAULT_LIMIT)
+            metrics.increment("sql_guard.limited")
+
+        if self.dialect == "mysql":
+            tree = add_execution_time_hint(tree, max_execution_ms or MAX_EXECUTION_MS)
+        return tree.sql(dialect=self.dialect)
+
+    @staticmethod
+    def _limit_value(tree: exp.Expression) -> Optional[int]:
+        limit = tree.args.get("limit")
+        if limit is None:
+            return None
+        try:
+            return int(limit.expression.name)
+        except (AttributeError, ValueError):
+            return None
+
+    def _explain(self, tree: exp.Expression) -> Optional[List[dict]]:
+        if self.explain is None or self.dialect != "mysql":
+            return None
+        try:
+            return self.explain(f"EXPLAIN {tree.sql(dialect=self.dialect)}")
+        except Exception as e:
+            # Let the database itself report real errors (unknown column etc.)
+            logger.warning(f"EXPLAIN failed, running without a cost estimate: {str(e)}")
+            return None
+
+
+class GuardedSQLDatabase(SQLDatabase):
+    """SQLDatabase whose string queries pass through SQLGuard first.
+
+    Both the agent's query tool and the direct fallback path end up in
+    `_execute`, so guarding here covers every LLM-generated statement.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.repairer = SchemaRepairer(load_schema(self))
+        self.guard = SQLGuard(
+            explain=lambda sql: super(GuardedSQLDatabase, self)._execute(sql),
+            dialect=self.dialect,
+            repairer=self.repairer
+        )
+
+    def _execute(self, command, fetch="all", *, parameters=None, execution_options=None):
+        if isinstance(command, str):
+            with stage("db.guard"):
+                command = self.guard.prepare(command)
+        with stage("db.query"):
+            result = super()._execute(command, fetch, parameters=parameters, execution_options=execution_options)
+        if fetch == "all":
+            record_rows(result)
+        return result
+
+    def run_no_throw(self, command, *args, **kwargs):
+        # The agent's query tool uses this; hand refusals back to the LLM so it
+        # can write a safer query instead of aborting the whole agent run
+        try:
+            return super().run_no_throw(command, *args, **kwargs)
+        except UnsafeQueryError as e:
+            return f"Error: {str(e)}"
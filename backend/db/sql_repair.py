@@ -0,0 +1,117 @@
+# db/sql_repair.py
+
+import difflib
+import logging
+from typing import Dict, List, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Names the LLM likes to use for columns that exist under another name.
+# Targets are only used when they really exist in the schema.
+COLUMN_SYNONYMS = {
+    'amount': ['amount_invested'],
+    'investment': ['amount_invested'],
+    'invested_amount': ['amount_invested'],
+    'date': ['date_'],
+    'transaction_date': ['date_'],
+    'rm': ['rm_name'],
+    'relationship_manager': ['rm_name'],
+    'stock': ['stock_name'],
+    'client': ['client_id'],
+    'transaction_id': ['transactoin_id', 'transaction_id'],
+    'transactoin_id': ['transaction_id', 'transactoin_id'],
+}
+
+FUZZY_CUTOFF = 0.75
+
+
+class SchemaRepairer:
+    """Map unknown table/column identifiers in a parsed query onto the real schema.
+
+    Works on the sqlglot AST, so string literals, function names and aliases
+    defined in the query itself are never touched.
+    """
+
+    def __init__(self, tables: Dict[str, List[str]]):
+        # lower-cased table name -> (real table name, {lower column: real column})
+        self.tables = {
+            name.lower(): (name, {c.lower(): c for c in columns})
+            for name, columns in tables.items()
+        }
+        self.all_columns = {c: real for _, cols in self.tables.values() for c, real in cols.items()}
+
+    def _match(self, name: str, candidates: Dict[str, str]) -> Optional[str]:
+        lowered = name.lower()
+        if lowered in candidates:
+            return candidates[lowered]
+        for target in COLUMN_SYNONYMS.get(lowered, []):
+            if target in candidates:
+                return candidates[target]
+        close = difflib.get_close_matches(lowered, list(candidates), n=1, cutoff=FUZZY_CUTOFF)
+        return candidates[close[0]] if close else None
+
+    def repair(self, tree: exp.Expression) -> exp.Expression:
+        """Rewrite unknown identifiers in place and return the tree"""
+        cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        output_aliases = {a.alias.lower() for a in tree.find_all(exp.Alias) if a.alias}
+        table_names = {t.lower(): real for t, (real, _) in self.tables.items()}
+
+        # Tables first, remembering which real table each alias points at
+        alias_to_table = {}
+        for table in tree.find_all(exp.Table):
+            name = table.name
+            if not name or name.lower() in cte_names:
+                continue
+            real = self._match(name, table_names)
+            if real and real != name:
+                logger.info(f"Repairing table {name} -> {real}")
+                table.set("this", exp.to_identifier(real))
+                metrics.increment("sql_repair.tables")
+            if real:
+                alias_to_table[(table.alias or real).lower()] = real.lower()
+                alias_to_table[real.lower()] = real.lower()
+
+        for column in tree.find_all(exp.Column):
+            name = column.name
+            if not name or isinstance(column.this, exp.Star):
+                continue
+            qualifier = column.table.lower() if column.table else None
+            if qualifier and qualifier in alias_to_table:
+                candidates = self.tables[alias_to_table[qualifier]][1]
+            elif qualifier is None:
+                if name.lower() in output_aliases and column.find_ancestor(exp.Alias) is None:
+                    continue  # e.g. ORDER BY total where total is a SELECT alias
+                candidates = {}
+                for table in set(alias_to_table.values()):
+                    candidates.update(self.tables[table][1])
+                candidates = candidates or self.all_columns
+            else:
+                continue  # qualified by a CTE or derived table we don't know the shape of
+
+            real = self._match(name, candidates)
+            if real and real != name:
+                logger.info(f"Repairing column {name} -> {real}")
+                column.set("this", exp.to_identifier(real, quoted=column.this.quoted))
+                metrics.increment("sql_repair.columns")
+        return tree
+
+    def repair_sql(self, sql: str, dialect: str = "mysql") -> str:
+        """Repair a SQL string; unparseable or already-correct SQL is returned as-is"""
+        try:
+            tree = sqlglot.parse_one(sql, read=dialect)
+        except ParseError:
+            return sql
+        before = tree.sql(dialect=dialect)
+        after = self.repair(tree).sql(dialect=dialect)
+        return sql if after == before else after
+
+
+def load_schema(db) -> Dict[str, List[str]]:
+    """{table: [columns]} from the metadata a LangChain SQLDatabase reflected on init"""
+    return {table.name: [column.name for column in table.columns] for table in db._metadata.sorted_tables}
@@ -1,12 +1,30 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from typing import Optional
 import uvicorn
 import time
 import re
-from agents.mongo_agent import query_mongo
+import threading
+import os
+import tempfile
+import io
+from starlette.concurrency import run_in_threadpool
+from agents.mongo_agent import query_mongo, collection as mongo_collection, MONGODB_AVAILABLE
 from agents.sql_agent import query_sql_database
+from db.sql_guard import UnsafeQueryError
+from services import (data_version, export, holdings, http_cache, ingest, metrics, profiling, query_log, refine,
+                      replay, sessions)
+from services.visualization import build_series
+from services.admission import CLIENT_KEYS, AdmissionRejected, admission, rate_limiter
+from services.answer_cache import answer_cache
+from services.change_tracker import change_tracker
+from services import entity_index as entities
+from services.sessions import session_store
+from services.single_flight import SingleFlight, normalize_question
+from services.tracing import RequestTrace, start_trace
 
 
 app = FastAPI(title="Valuefy AI Portfolio Assistant", version="1.0.0")
@@ -18,20 +36,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
+# Chart series make large /ask bodies; they shrink several-fold compressed
+app.add_middleware(GZipMiddleware, minimum_size=http_cache.GZIP_MIN_BYTES)
+
+# Identical questions arriving while one is already being answered share its result
+agent_flight = SingleFlight("ask")
 
 class QuestionRequest(BaseModel):
     question: str
+    # Pass the session_id from the previous response to ask follow-ups
+    session_id: Optional[str] = None
 
 class QuestionResponse(BaseModel):
     answer: str
     processing_time: Optional[str] = None
     visualization_data: Optional[dict] = None
+    session_id: Optional[str] = None
 
 @app.get("/")
 async def root():
     return {"message": "Valuefy AI Portfolio Assistant API", "status": "running"}
 
+@app.get("/metrics")
+async def get_metrics():
+    """Expose request and duplicate-suppression counters"""
+    data = metrics.snapshot()
+    data["gauges"]["ask.in_flight"] = agent_flight.in_flight()
+    data["data_versions"] = data_version.snapshot()
+    return data
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint to verify all components are working"""
@@ -121,32 +156,342 @@ def determine_query_type(question: str) -> str:
     # Return the type with higher score
     return 'mongo' if mongo_score > sql_score else 'sql'
 
+def run_agent(question: str, query_type: str):
+    """Dispatch the question to the agent chosen by determine_query_type.
+
+    Returns the answer together with the trace the agent recorded into
+    (generated query, stage latencies, result size).
+    """
+    record_spans = profiling.current() is not None
+    with start_trace(question, query_type, record_spans) as trace, profiling.capture():
+        if query_type == 'mongo':
+            # Use MongoDB agent for client/portfolio queries
+            mongo_response = query_mongo(question)
+            # Handle both string and dictionary responses from MongoDB agent
+            if isinstance(mongo_response, dict):
+                answer = mongo_response.get('answer', 'No response from MongoDB agent')
+            else:
+                answer = str(mongo_response)
+        else:
+            # Use SQL agent for transaction queries
+            answer = query_sql_database(question)
+    return answer, trace
+
+def compute_answer(question: str, query_type: str):
+    """Run the agent and cache its answer unless the agent reported a failure.
+
+    Chart series are computed from the agent's result rows here, once, and
+    cached alongside the answer. The entry is tagged with the clients/stocks/
+    RMs the question mentions so the change tracker can invalidate just the
+    answers a write affects.
+    """
+    answer, trace = run_agent(question, query_type)
+    payload = {
+        "answer": answer,
+        "visualization": build_series(trace.rows),
+        "tags": change_tracker.tags_for_question(question),
+        "query": trace.generated_query,
+        # Small result sets ride along so follow-ups on a cached answer can be refined
+        "rows": trace.rows if trace.rows and len(trace.rows) <= sessions.MAX_ROWS else None
+    }
+    if not trace.failed:
+        answer_cache.put(query_type, question, payload)
+    return payload, trace
+
+@app.on_event("startup")
+async def start_background_jobs():
+    # Mock client names are indexed when mongo_agent is imported; load the
+    # MySQL names off the event loop, lookups just miss them until it lands
+    threading.Thread(target=entities.refresh, args=(entities.entity_index,),
+                     name="entity-index-load", daemon=True).start()
+    replay.start_scheduler(compute_answer)
+    change_tracker.start(mongo_collection=mongo_collection)
+    holdings.start()
+
+@app.post("/admin/replay")
+async def replay_hot_questions(top: int = replay.REPLAY_TOP_K):
+    """Re-run the most frequently asked questions to warm the answer cache"""
+    return await run_in_threadpool(replay.replay_top_questions, compute_answer, top)
+
+@app.post("/admin/ingest")
+async def ingest_transactions(
+    http_request: Request,
+    format: Optional[str] = None,
+    batch_size: int = ingest.BATCH_SIZE,
+    method: str = ingest.METHOD,
+    dry_run: bool = False
+):
+    """Bulk load transactions from a CSV or JSONL request body"""
+    if format is None:
+        content_type = http_request.headers.get("content-type", "")
+        format = "jsonl" if "json" in content_type else "csv"
+
+    # Spool the body to disk so a large upload never sits in memory
+    spool = tempfile.TemporaryFile()
+    try:
+        async for chunk in http_request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        stream = io.TextIOWrapper(spool, encoding="utf-8", newline="")
+        report = await run_in_threadpool(
+            ingest.ingest_stream, stream, format,
+            batch_size=batch_size, method=method, dry_run=dry_run
+        )
+        # A load the database cut short is not a success; the report says how far it got
+        if "error" in report:
+            return JSONResponse(status_code=500, content=report)
+        return report
+    except ingest.IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        import logging
+        logging.error(f"Ingest failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Ingest failed: {str(e)}")
+    finally:
+        spool.close()
+
+def holdings_filters(client_id: Optional[str], stock_name: Optional[str], rm_name: Optional[str]) -> dict:
+    filters = {"client_id": client_id, "stock_name": stock_name, "rm_name": rm_name}
+    return {column: [value] for column, value in filters.items() if value}
+
+async def run_holdings_query(fn, *args):
+    """Run a holdings analytics query, mapping bad parameters to 400"""
+    if not holdings.holdings.loaded:
+        raise HTTPException(status_code=503, detail="Holdings analytics are still loading")
+    try:
+        return await run_in_threadpool(fn, *args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/analytics/cumulative")
+async def holdings_cumulative(
+    group_by: Optional[str] = None,
+    freq: str = "month",
+    client_id: Optional[str] = None,
+    stock_name: Optional[str] = None,
+    rm_name: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None
+):
+    """Per-period invested amounts and running totals, optionally per client/stock/RM"""
+    filters = holdings_filters(client_id, stock_name, rm_name)
+    return await run_holdings_query(holdings.holdings.cumulative, group_by, freq, filters, start, end)
+
+@app.get("/analytics/period-over-period")
+async def holdings_period_over_period(
+    period: str = "month",
+    group_by: Optional[str] = None,
+    client_id: Optional[str] = None,
+    stock_name: Optional[str] = None,
+    rm_name: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None
+):
+    """Invested amount per period with the change on the previous period"""
+    filters = holdings_filters(client_id, stock_name, rm_name)
+    return await run_holdings_query(holdings.holdings.period_over_period, period, group_by, filters, start, end)
+
+@app.get("/analytics/concentration")
+async def holdings_concentration(
+    by: str = "stock_name",
+    client_id: Optional[str] = None,
+    stock_name: Optional[str] = None,
+    rm_name: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    top: int = 5
+):
+    """Share of the invested total per client, stock or RM, with top-k share and HHI"""
+    filters = holdings_filters(client_id, stock_name, rm_name)
+    return await run_holdings_query(holdings.holdings.concentration, by, filters, start, end, top)
+
+@app.post("/admin/profiling")
+async def arm_profiling(requests: int = 1, mode: str = "cprofile"):
+    """Profile the next N /ask requests (mode 'cprofile' or 'sample')"""
+    try:
+        return {"armed": profiling.arm(requests, mode)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/admin/profiles")
+async def list_profiles():
+    """Stored request profiles, newest first"""
+    return await run_in_threadpool(profiling.list_profiles)
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, artifact: str = "summary"):
+    """Download a profile artifact: summary, spans or stacks (folded) or cprofile (pstats)"""
+    path = profiling.artifact_path(profile_id, artifact)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile artifact not found")
+    return FileResponse(path, filename=os.path.basename(path))
+
+@app.get("/export")
+async def export_answer(format: str = "csv", session_id: Optional[str] = None, question: Optional[str] = None):
+    """Stream the rows behind an answer as CSV, Arrow IPC or Parquet.
+
+    Identify the answer by the session that received it (its latest answer)
+    or by re-sending the question, which must still be in the answer cache.
+    """
+    session = session_store.get(session_id)
+    if session is not None:
+        route, query, rows = session.route, session.query, session.rows
+    elif question:
+        route = determine_query_type(question)
+        payload = answer_cache.get(route, question) or {}
+        query, rows = payload.get("query"), payload.get("rows")
+    else:
+        raise HTTPException(status_code=400, detail="Pass the session_id or question of the answer to export")
+    if query is None and not rows:
+        raise HTTPException(status_code=404, detail="No recent answer found to export; ask the question first")
+
+    try:
+        body = await run_in_threadpool(export.open_export, route, query, format, rows, mongo_collection)
+    except (export.ExportError, UnsafeQueryError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type, extension = export.FORMATS[format]
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="export.{extension}"'})
+
+def client_key(http_request: Request) -> str:
+    """Identify the caller for rate limiting.
+
+    A configured X-Client-Key (ADMISSION_CLIENT_KEYS) gets its own bucket;
+    anything else is keyed on the client IP, so inventing a fresh key per
+    request doesn't reset the limit.
+    """
+    key = http_request.headers.get("X-Client-Key")
+    if key and key in CLIENT_KEYS:
+        return f"key:{key}"
+    return http_request.client.host if http_request.client else "anonymous"
+
+def rejection(error: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=error.status_code,
+        detail=error.reason,
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+async def fetch_answer(question: str, query_type: str, flight_key, coalesced: bool, profile=None):
+    """Run or join the agent computation, queueing only work that will hit the LLM.
+
+    Joining a computation already in flight and the mock-data Mongo route
+    cost no LLM call, so they bypass the admission queue. Profiled requests
+    run their own computation so the profile covers it.
+    """
+    compute = lambda: run_in_threadpool(compute_answer, question, query_type)
+    if profile is not None and profile.mode:
+        async with admission.slot():
+            return await compute()
+    if coalesced or (query_type == 'mongo' and not MONGODB_AVAILABLE):
+        metrics.increment("admission.bypassed")
+        return await agent_flight.do(flight_key, compute)
+    async with admission.slot():
+        return await agent_flight.do(flight_key, compute)
+
 @app.post("/ask", response_model=QuestionResponse)
-async def ask_question(request: QuestionRequest):
+async def ask_question(request: QuestionRequest, http_request: Request, http_response: Response):
+    return await answer_question(request, http_request, http_response)
+
+@app.get("/ask", response_model=QuestionResponse)
+async def ask_question_cacheable(question: str, http_request: Request, http_response: Response):
+    """Cacheable variant for standalone questions.
+
+    It takes no session, so the answer depends only on the question and the
+    data version and browsers or proxies may reuse it for a short while.
+    """
+    return await answer_question(QuestionRequest(question=question), http_request, http_response, shared=True)
+
+async def answer_question(request: QuestionRequest, http_request: Request, http_response: Response,
+                          shared: bool = False):
     try:
         import time
         start_time = time.time()
+        metrics.increment("ask.requests")
         
         # Validate request
         if not request.question or not request.question.strip():
             raise HTTPException(status_code=400, detail="Question cannot be empty")
         
+        try:
+            rate_limiter.take(client_key(http_request))
+        except AdmissionRejected as e:
+            raise rejection(e)
+        
+        profile = profiling.for_request(http_request.headers.get(profiling.PROFILE_HEADER),
+                                        http_request.headers.get(profiling.PROFILE_TOKEN_HEADER))
+        trace = RequestTrace(request.question, record_spans=profile is not None)
+        
+        # Follow-ups that only filter, sort or limit the session's last result
+        # are answered from its rows without an LLM or DB round trip
+        session_id = None if shared else request.session_id or session_store.new_id()
+        session = session_store.get(request.session_id)
+        refined = None
+        if session is not None:
+            with trace.stage("refine"):
+                refined = refine.refine(request.question, session)
+        question = request.question if refined else refine.contextualize(request.question, session)
+        
         # Determine which agent to use based on intelligent routing
-        query_type = determine_query_type(request.question)
+        if refined is not None:
+            query_type = session.route
+        else:
+            with trace.stage("routing"):
+                query_type = determine_query_type(question)
+        trace.route = query_type
         
+        # Answers to questions that stand on their own are cached and carry an ETag
+        standalone = refined is None and question == request.question and not (profile is not None and profile.mode)
+        etag = None
+        cached = None
+        coalesced = False
+        if refined is None:
+            cached = None if profile is not None and profile.mode else answer_cache.get(query_type, question)
+            # Only a live cached answer can vouch for the client's copy: reply 304 without any agent work
+            if cached is not None and standalone:
+                etag = http_cache.etag_for(question, query_type, cached)
+                if http_cache.matches(http_request.headers.get("If-None-Match"), etag):
+                    metrics.increment("ask.not_modified")
+                    # Point the caller's session at the answer it is showing; a 304 can't hand out a new one
+                    if request.session_id and cached.get("rows"):
+                        session_store.put(request.session_id, question, query_type, cached.get("query"),
+                                          cached["rows"])
+                    return Response(status_code=304, headers=http_cache.headers(etag, shared))
+            flight_key = (query_type, normalize_question(question))
+            coalesced = agent_flight.is_in_flight(flight_key)
+        chart = None
         try:
-            if query_type == 'mongo':
-                # Use MongoDB agent for client/portfolio queries
-                mongo_response = query_mongo(request.question)
-                # Handle both string and dictionary responses from MongoDB agent
-                if isinstance(mongo_response, dict):
-                    response = mongo_response.get('answer', 'No response from MongoDB agent')
-                else:
-                    response = str(mongo_response)
+            if refined is not None:
+                metrics.increment("sessions.refined")
+                payload = {
+                    "answer": refined["answer"],
+                    "visualization": build_series(refined["rows"]),
+                    "query": refined["query"],
+                    "rows": refined["rows"]
+                }
+                trace.generated_query = refined["query"]
+                trace.result_rows = len(refined["rows"])
+                question = f"{session.question} ({refined['query']['refine']})"
+            elif cached is not None:
+                metrics.increment("admission.bypassed")
+                payload = cached
             else:
-                # Use SQL agent for transaction queries
-                response = query_sql_database(request.question)
+                with profiling.activate(profile), trace.stage("agent"):
+                    payload, agent_trace = await fetch_answer(question, query_type, flight_key,
+                                                              coalesced, profile)
+                    trace.merge(agent_trace)
+                if standalone and not trace.failed:
+                    etag = http_cache.etag_for(question, query_type, payload)
+            response = payload["answer"]
+            chart = payload.get("visualization")
+            if session_id:
+                # An empty refinement keeps the rows it filtered for the next follow-up
+                if refined is None or refined["rows"]:
+                    session_store.put(session_id, question, query_type, payload.get("query"), payload.get("rows"))
+        except AdmissionRejected as e:
+            raise rejection(e)
         except Exception as agent_error:
+            trace.failed = str(agent_error)
             # Log the actual error for debugging
             import logging
             logging.error(f"Agent error: {str(agent_error)}")
@@ -156,6 +501,17 @@ async def ask_question(request: QuestionRequest):
             response = f"Sorry, I encountered an error while processing your question: {str(agent_error)}. Please try rephrasing your question."
         
         processing_time = f"{(time.time() - start_time):.2f}s"
+        # Log follow-ups under the question that was actually answered
+        trace.question = question
+        follow_up = "refined" if refined else "contextualized" if question != request.question else None
+        # File I/O under a lock: keep it off the event loop
+        await run_in_threadpool(query_log.append, trace, cached=cached is not None, coalesced=coalesced,
+                                follow_up=follow_up)
+        if profile is not None:
+            await run_in_threadpool(profiling.finish, profile, trace)
+            if profile.id:
+                http_response.headers["X-Profile-Id"] = profile.id
+        http_response.headers.update(http_cache.headers(None if trace.failed else etag, shared))
         
         # Add visualization data for certain queries
         visualization_data = None
@@ -181,10 +537,20 @@ async def ask_question(request: QuestionRequest):
                 "query_type": query_type
             }
         
+        # Attach the chart-ready series computed from the query results
+        if chart:
+            visualization_data = visualization_data or {
+                "type": "data_analysis",
+                "query": request.question,
+                "query_type": query_type
+            }
+            visualization_data.update(chart)
+        
         return QuestionResponse(
             answer=response,
             processing_time=processing_time,
-            visualization_data=visualization_data
+            visualization_data=visualization_data,
+            session_id=session_id
         )
         
     except HTTPException:
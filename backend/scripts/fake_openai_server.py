@@ -0,0 +1,64 @@
+# scripts/fake_openai_server.py
+#
+# Minimal OpenAI-compatible chat completions server for exercising the LLM
+# client layer locally (keep-alive, retries, deadlines, hedging).
+#
+#   FAKE_LATENCY=0.2 FAKE_SLOW_RATE=0.1 FAKE_ERROR_RATE=0.1 python scripts/fake_openai_server.py
+#   OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=fake uvicorn main:app
+
+import asyncio
+import os
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY = float(os.getenv("FAKE_LATENCY", "0.2"))
+SLOW_LATENCY = float(os.getenv("FAKE_SLOW_LATENCY", "3"))
+SLOW_RATE = float(os.getenv("FAKE_SLOW_RATE", "0"))
+ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+REPLY = os.getenv("FAKE_REPLY", "SELECT COUNT(*) FROM transactions;")
+
+app = FastAPI(title="Fake OpenAI")
+stats = {"requests": 0, "errors": 0, "slow": 0}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+
+    if random.random() < ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse(status_code=503, content={"error": {"message": "fake overload", "type": "server_error"}})
+
+    if random.random() < SLOW_RATE:
+        stats["slow"] += 1
+        await asyncio.sleep(SLOW_LATENCY)
+    else:
+        await asyncio.sleep(LATENCY)
+
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": REPLY},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("FAKE_PORT", "8001")))
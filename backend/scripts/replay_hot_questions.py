@@ -0,0 +1,40 @@
+# scripts/replay_hot_questions.py
+#
+# Show the most frequent questions from the /ask log, or ask a running API
+# to re-run them and warm its answer cache (e.g. from cron before business
+# hours):
+#
+#   python scripts/replay_hot_questions.py --top 20
+#   python scripts/replay_hot_questions.py --top 20 --url http://localhost:8000
+
+import argparse
+import json
+import os
+import sys
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import query_log  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay hot /ask questions")
+    parser.add_argument("--top", type=int, default=20, help="number of questions to replay")
+    parser.add_argument("--days", type=float, default=7, help="look-back window in days")
+    parser.add_argument("--url", help="base URL of a running API to warm")
+    args = parser.parse_args()
+
+    if not args.url:
+        for item in query_log.top_questions(args.top, days=args.days):
+            print(f"{item['count']:>6}  [{item['route']}] {item['question']}")
+        return
+
+    response = httpx.post(f"{args.url.rstrip('/')}/admin/replay", params={"top": args.top}, timeout=None)
+    response.raise_for_status()
+    print(json.dumps(response.json(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# services/admission.py
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from services import metrics
+
+MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "20"))
+RATE_PER_SECOND = float(os.getenv("ADMISSION_RATE_PER_SECOND", "1"))
+BURST = float(os.getenv("ADMISSION_BURST", "10"))
+MAX_TRACKED_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", "10000"))
+# X-Client-Key values that get their own bucket (e.g. BI scrapers behind one proxy IP)
+CLIENT_KEYS = frozenset(k.strip() for k in os.getenv("ADMISSION_CLIENT_KEYS", "").split(",") if k.strip())
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; carries the HTTP status and Retry-After"""
+
+    def __init__(self, status_code: int, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+class TokenBucketLimiter:
+    """Per-client token buckets, refilled at RATE_PER_SECOND up to BURST"""
+
+    def __init__(self, rate: float = RATE_PER_SECOND, burst: float = BURST, max_keys: int = MAX_TRACKED_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> (tokens, last refill); least recently seen keys are evicted
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, cost: float = 1.0) -> None:
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < cost:
+                self._buckets[key] = (tokens, now)
+                metrics.increment("admission.rate_limited")
+                raise AdmissionRejected(429, (cost - tokens) / self.rate, "Rate limit exceeded")
+            self._buckets[key] = (tokens - cost, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+
+class AdmissionController:
+    """Bounded queue in front of the LLM-backed agent path.
+
+    At most MAX_CONCURRENT requests run the agent at once and at most
+    MAX_QUEUE wait behind them. A request is shed with 503 straight away if
+    the queue is full or its estimated wait (queue position times the
+    moving-average service time) exceeds MAX_WAIT_SECONDS. Cache hits and
+    other fast-path answers never enter this queue.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT, max_queue: int = MAX_QUEUE,
+                 max_wait: float = MAX_WAIT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.waiting = 0
+        self.active = 0
+        self._service_time = 5.0
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def estimated_wait(self) -> float:
+        if self.active < self.max_concurrent:
+            return 0.0
+        return (self.waiting + 1) * self._service_time / self.max_concurrent
+
+    def _publish(self) -> None:
+        metrics.set_gauge("admission.queue_depth", self.waiting)
+        metrics.set_gauge("admission.active", self.active)
+        metrics.set_gauge("admission.estimated_wait_seconds", round(self.estimated_wait(), 2))
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+
+        wait = self.estimated_wait()
+        if self.waiting >= self.max_queue or wait > self.max_wait:
+            metrics.increment("admission.shed")
+            raise AdmissionRejected(503, wait or self._service_time, "Server busy, please retry shortly")
+
+        self.waiting += 1
+        self._publish()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            metrics.increment("admission.shed")
+            raise AdmissionRejected(503, self._service_time, "Server busy, please retry shortly")
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        self._publish()
+        metrics.increment("admission.admitted")
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._slots.release()
+            # Exponential moving average of how long an agent run holds a slot
+            self._service_time = 0.8 * self._service_time + 0.2 * (time.monotonic() - started)
+            self._publish()
+
+
+rate_limiter = TokenBucketLimiter()
+admission = AdmissionController()
@@ -0,0 +1,66 @@
+# services/answer_cache.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+from services import metrics
+from services.single_flight import normalize_question
+
+MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+
+class AnswerCache:
+    """Thread-safe LRU cache of /ask payloads keyed by route and normalized question"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl: float = TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(route: str, question: str) -> Tuple[str, str]:
+        return (route, normalize_question(question))
+
+    def get(self, route: str, question: str) -> Optional[dict]:
+        key = self.key(route, question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                metrics.increment("answer_cache.misses")
+                return None
+            self._entries.move_to_end(key)
+        metrics.increment("answer_cache.hits")
+        return entry[1]
+
+    def put(self, route: str, question: str, payload: dict) -> None:
+        key = self.key(route, question)
+        with self._lock:
+            self._entries[key] = (time.time(), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.increment("answer_cache.evictions")
+            metrics.set_gauge("answer_cache.entries", len(self._entries))
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable, dict], bool]] = None) -> int:
+        """Drop entries matching predicate(key, payload), or everything if None"""
+        with self._lock:
+            if predicate is None:
+                keys = list(self._entries)
+            else:
+                keys = [k for k, (_, payload) in self._entries.items() if predicate(k, payload)]
+            for k in keys:
+                del self._entries[k]
+            metrics.set_gauge("answer_cache.entries", len(self._entries))
+        metrics.increment("answer_cache.invalidations", len(keys))
+        return len(keys)
+
+
+answer_cache = AnswerCache()
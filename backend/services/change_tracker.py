@@ -0,0 +1,214 @@
+# services/change_tracker.py
+
+import logging
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterable, List, Optional, Set
+
+from services import data_version, metrics
+from services.answer_cache import answer_cache
+from services.entity_index import entity_index, bind_parameters
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("CHANGE_TRACKING_ENABLED", "false").lower() == "true"
+POLL_SECONDS = float(os.getenv("CHANGE_POLL_SECONDS", "5"))
+BATCH_SIZE = int(os.getenv("CHANGE_POLL_BATCH", "5000"))
+# The live table really spells it `transactoin_id`
+ID_COLUMN = os.getenv("CHANGE_TRACKING_ID_COLUMN", "transactoin_id")
+
+
+class ChangeSet:
+    """The entities touched by a batch of changed rows in one source"""
+
+    def __init__(self, source: str, rows: Optional[List[dict]] = None, full: bool = False):
+        self.source = source
+        self.rows = rows or []
+        # A full change means we know data changed but not which rows
+        self.full = full
+        self.tags: Set[str] = set()
+        for row in self.rows:
+            self.tags.update(row_tags(row))
+
+    def __repr__(self):
+        return f"ChangeSet(source={self.source!r}, rows={len(self.rows)}, full={self.full}, tags={len(self.tags)})"
+
+
+def row_tags(row: dict) -> Set[str]:
+    tags = set()
+    if row.get("client_id"):
+        tags.add(f"client:{str(row['client_id']).lower()}")
+    if row.get("stock_name"):
+        tags.add(f"stock:{str(row['stock_name']).lower()}")
+    if row.get("rm_name"):
+        tags.add(f"rm:{str(row['rm_name']).lower()}")
+    if row.get("rm_id"):
+        tags.add(f"rm_id:{str(row['rm_id']).lower()}")
+    return tags
+
+
+class ChangeTracker:
+    """Detect data changes and invalidate only the cache entries they affect.
+
+    MySQL is polled with a high-watermark on the auto-increment id, which
+    yields exactly the inserted rows. Updates and deletes don't move the
+    watermark, so a cheap COUNT/SUM checksum is compared as well; when it
+    moves without new ids we can't tell which rows changed and fall back
+    to invalidating every SQL answer. Mongo uses change streams when a real
+    collection is configured.
+
+    Cached answers are tagged with the clients, stocks and RMs their
+    question mentions. Answers without tags aggregate over the whole table
+    and are invalidated by any change to their source.
+    """
+
+    def __init__(self):
+        self.watermark: Optional[int] = None
+        self.checksum = None
+        self._listeners: List[Callable[[ChangeSet], None]] = []
+
+    def subscribe(self, listener: Callable[[ChangeSet], None]) -> None:
+        """Register a callback run for every ChangeSet (e.g. rollup maintenance)"""
+        self._listeners.append(listener)
+
+    def tags_for_question(self, question: str) -> List[str]:
+        """Cache tags for the clients, stocks and RMs a question mentions"""
+        tags = set()
+        for column, values in bind_parameters(entity_index.extract(question)).items():
+            tags.update(row_tags({column: value}).pop() for value in values)
+        return sorted(tags)
+
+    def learn_names(self, rows: Iterable[dict]) -> None:
+        """Feed names seen in changed rows to the entity index"""
+        entries = []
+        for row in rows:
+            for column, kind in (("client_id", "client"), ("stock_name", "stock"), ("rm_name", "rm")):
+                if row.get(column):
+                    entries.append((row[column], kind, row[column]))
+        entity_index.add_many(entries)
+
+    def apply(self, changes: ChangeSet) -> int:
+        """Bump the data version, invalidate affected answers and notify listeners"""
+        data_version.bump(changes.source)
+        self.learn_names(changes.rows)
+
+        def affected(key, payload):
+            if key[0] != changes.source:
+                return False
+            tags = payload.get("tags")
+            return changes.full or not tags or bool(changes.tags.intersection(tags))
+
+        dropped = answer_cache.invalidate(affected)
+        metrics.increment(f"change_tracker.{changes.source}.changes")
+        logger.info(f"{changes}: invalidated {dropped} cached answers")
+
+        for listener in self._listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                logger.error(f"Change listener failed: {str(e)}")
+        return dropped
+
+    # ---- MySQL ------------------------------------------------------------
+
+    def _query(self, sql: str, params: tuple = ()) -> List[dict]:
+        from db.mysql_conn import get_mysql_connection
+
+        conn = get_mysql_connection()
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            conn.close()
+
+    def _read_checksum(self):
+        row = self._query(
+            f"SELECT COUNT(*) AS n, MAX({ID_COLUMN}) AS max_id, SUM(amount_invested) AS total FROM transactions"
+        )[0]
+        return row["n"], row["max_id"], float(row["total"] or 0)
+
+    def init_mysql(self) -> None:
+        """Start watching from the current end of the table"""
+        count, max_id, total = self._read_checksum()
+        self.watermark = max_id or 0
+        self.checksum = (count, max_id, total)
+        logger.info(f"Change tracking transactions from {ID_COLUMN} > {self.watermark}")
+
+    def poll_mysql(self) -> Optional[ChangeSet]:
+        """Fetch rows past the watermark; detect non-insert changes via the checksum"""
+        # Read the checksum first and only consume ids it covers, so rows
+        # inserted while we poll are left for the next round
+        count, max_id, total = self._read_checksum()
+        rows = []
+        while max_id is not None and self.watermark < max_id:
+            batch = self._query(
+                f"SELECT {ID_COLUMN} AS id, client_id, stock_name, amount_invested, date_, rm_name "
+                f"FROM transactions WHERE {ID_COLUMN} > %s AND {ID_COLUMN} <= %s ORDER BY {ID_COLUMN} LIMIT %s",
+                (self.watermark, max_id, BATCH_SIZE)
+            )
+            if not batch:
+                break
+            rows.extend(batch)
+            self.watermark = batch[-1]["id"]
+
+        expected_count = self.checksum[0] + len(rows)
+        expected_total = self.checksum[2] + sum(float(r["amount_invested"] or 0) for r in rows)
+        self.checksum = (count, max_id, total)
+
+        in_band = count == expected_count and math.isclose(total, expected_total, rel_tol=1e-9, abs_tol=0.01)
+        if not in_band:
+            logger.info("transactions changed outside the insert watermark, invalidating all SQL answers")
+            return ChangeSet("sql", rows, full=True)
+        if rows:
+            return ChangeSet("sql", rows)
+        return None
+
+    # ---- MongoDB ----------------------------------------------------------
+
+    def watch_mongo(self, collection) -> None:
+        """Follow a Mongo change stream (needs a replica set) until it fails"""
+        from pymongo.errors import PyMongoError
+
+        try:
+            with collection.watch(full_document="updateLookup") as stream:
+                for event in stream:
+                    document = event.get("fullDocument") or {}
+                    if event.get("operationType") in ("delete", "drop", "rename", "invalidate") or not document:
+                        self.apply(ChangeSet("mongo", full=True))
+                    else:
+                        self.apply(ChangeSet("mongo", [document]))
+        except PyMongoError as e:
+            logger.error(f"Mongo change stream unavailable: {str(e)}")
+
+    # ---- lifecycle --------------------------------------------------------
+
+    def start(self, mongo_collection=None) -> None:
+        """Start the background pollers when CHANGE_TRACKING_ENABLED is set"""
+        if not ENABLED:
+            return
+
+        def poll_loop():
+            while True:
+                try:
+                    if self.watermark is None:
+                        self.init_mysql()
+                    else:
+                        changes = self.poll_mysql()
+                        if changes is not None:
+                            self.apply(changes)
+                except Exception as e:
+                    logger.error(f"Change tracking poll failed: {str(e)}")
+                time.sleep(POLL_SECONDS)
+
+        threading.Thread(target=poll_loop, name="change-tracker-mysql", daemon=True).start()
+        if mongo_collection is not None:
+            threading.Thread(target=self.watch_mongo, args=(mongo_collection,),
+                             name="change-tracker-mongo", daemon=True).start()
+
+
+change_tracker = ChangeTracker()
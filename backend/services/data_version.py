@@ -0,0 +1,30 @@
+# services/data_version.py
+
+import threading
+import time
+
+_lock = threading.Lock()
+_versions = {"sql": 0, "mongo": 0}
+_changed_at = {"sql": time.time(), "mongo": time.time()}
+
+
+def get_version(source: str) -> int:
+    """Current data-version token for a source ('sql' or 'mongo')"""
+    with _lock:
+        return _versions.get(source, 0)
+
+
+def bump(source: str) -> int:
+    """Advance the token after the source's data changed"""
+    with _lock:
+        _versions[source] = _versions.get(source, 0) + 1
+        _changed_at[source] = time.time()
+        return _versions[source]
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            source: {"version": version, "changed_at": _changed_at[source]}
+            for source, version in _versions.items()
+        }
@@ -0,0 +1,243 @@
+# services/entity_index.py
+
+import logging
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Entity kinds and the column each one binds to
+KIND_COLUMNS = {
+    "client": "client_id",
+    "rm": "rm_name",
+    "rm_id": "rm_id",
+    "stock": "stock_name",
+}
+
+
+class _Automaton:
+    """Aho-Corasick trie with failure links; build() must run after the last add()"""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.out: List[List[Tuple[int, str, str]]] = [[]]
+        self.fail: List[int] = [0]
+        self.matches: List[List[Tuple[int, str, str]]] = [[]]
+        self.size = 0
+
+    def add(self, text: str, kind: str, value: str) -> bool:
+        node = 0
+        for ch in text:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.out.append([])
+                self.goto[node][ch] = nxt
+            node = nxt
+        entry = (len(text), kind, value)
+        if entry in self.out[node]:
+            return False
+        self.out[node].append(entry)
+        self.size += 1
+        return True
+
+    def build(self) -> "_Automaton":
+        """Breadth-first computation of failure links and merged outputs"""
+        fail = [0] * len(self.goto)
+        matches = [list(own) for own in self.out]
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                f = fail[node]
+                while f and ch not in self.goto[f]:
+                    f = fail[f]
+                fail[child] = self.goto[f].get(ch, 0)
+                matches[child].extend(matches[fail[child]])
+                queue.append(child)
+        self.fail, self.matches = fail, matches
+        return self
+
+    def scan(self, text: str, found: list) -> None:
+        goto, fail, matches = self.goto, self.fail, self.matches
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, kind, value in matches[node]:
+                start = i - length + 1
+                if _is_boundary(text, start - 1) and _is_boundary(text, i + 1):
+                    found.append((start, i + 1, kind, value))
+
+
+class EntityIndex:
+    """Aho-Corasick index over client, RM and stock names.
+
+    `extract` finds every known entity in a question in one pass over its
+    characters, however many names are indexed. Matches must sit on word
+    boundaries; overlapping matches resolve to the longest one.
+
+    Names added after the initial load go into a small delta automaton that
+    is cheap to rebuild; once it grows past MERGE_THRESHOLD the main
+    automaton is rebuilt in the background and swapped in.
+    """
+
+    MERGE_THRESHOLD = 1000
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str, str], None] = {}
+        self._main = _Automaton().build()
+        self._delta = _Automaton().build()
+        self._delta_keys: set = set()
+        self._merging = False
+        self._lock = threading.Lock()
+
+    def add(self, surface: str, kind: str, value: Optional[str] = None) -> None:
+        """Index `surface` (e.g. a client name) as an entity bound to `value`"""
+        self.add_many([(surface, kind, value)])
+
+    def add_many(self, entries: Iterable[Tuple[str, str, Optional[str]]]) -> None:
+        new = []
+        for surface, kind, value in entries:
+            text = str(surface or "").strip().lower()
+            if not text:
+                continue
+            key = (text, kind, str(value) if value is not None else str(surface).strip())
+            if key not in self._entries:
+                new.append(key)
+        if not new:
+            return
+
+        with self._lock:
+            for key in new:
+                self._entries[key] = None
+            if self._main.size == 0 and not self._delta_keys:
+                # Initial bulk load goes straight into the main automaton
+                self._main = self._rebuild(self._entries)
+            else:
+                self._delta_keys.update(new)
+                self._delta = self._rebuild(self._delta_keys)
+            pending = len(self._delta_keys)
+        metrics.set_gauge("entity_index.size", len(self._entries))
+
+        if pending > self.MERGE_THRESHOLD and not self._merging:
+            self._merging = True
+            threading.Thread(target=self._merge, name="entity-index-merge", daemon=True).start()
+
+    @staticmethod
+    def _rebuild(keys) -> _Automaton:
+        automaton = _Automaton()
+        for text, kind, value in keys:
+            automaton.add(text, kind, value)
+        return automaton.build()
+
+    def _merge(self) -> None:
+        with self._lock:
+            snapshot = list(self._entries)
+        main = self._rebuild(snapshot)
+        with self._lock:
+            merged = set(snapshot)
+            self._main = main
+            self._delta_keys = {k for k in self._delta_keys if k not in merged}
+            self._delta = self._rebuild(self._delta_keys)
+            self._merging = False
+        logger.info(f"Entity index merged, {len(snapshot)} names")
+
+    def extract(self, question: str) -> List[dict]:
+        """All indexed entities mentioned in the question, longest match wins"""
+        text = question.lower()
+        found = []
+        main, delta = self._main, self._delta
+        main.scan(text, found)
+        if delta.size:
+            delta.scan(text, found)
+
+        # Prefer longer matches, then drop anything overlapping an accepted one
+        found.sort(key=lambda m: (-(m[1] - m[0]), m[0]))
+        taken, entities, seen = [], [], set()
+        for start, end, kind, value in found:
+            overlapping = [t for t in taken if start < t[1] and t[0] < end]
+            if overlapping and (start, end) not in overlapping:
+                continue
+            if (start, end) not in taken:
+                taken.append((start, end))
+            if (start, kind, value) in seen:
+                continue
+            seen.add((start, kind, value))
+            entities.append({"kind": kind, "value": value, "text": question[start:end], "start": start})
+        entities.sort(key=lambda e: e["start"])
+        return entities
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _is_boundary(text: str, index: int) -> bool:
+    return index < 0 or index >= len(text) or not text[index].isalnum()
+
+
+def bind_parameters(entities: List[dict]) -> Dict[str, List[str]]:
+    """Group extracted entities into {column: [values]} for the agents"""
+    params: Dict[str, List[str]] = {}
+    for entity in entities:
+        column = KIND_COLUMNS.get(entity["kind"])
+        if column and entity["value"] not in params.setdefault(column, []):
+            params[column].append(entity["value"])
+    return params
+
+
+def describe_parameters(params: Dict[str, List[str]]) -> str:
+    """Render bound parameters for an LLM prompt, e.g. client_id = 'C001'"""
+    parts = []
+    for column, values in params.items():
+        quoted = ", ".join(f"'{v}'" for v in values)
+        parts.append(f"{column} = {quoted}" if len(values) == 1 else f"{column} IN ({quoted})")
+    return "; ".join(parts)
+
+
+def load_mysql(index: EntityIndex) -> None:
+    """Index distinct client ids, RM names and stock names from transactions"""
+    from db.mysql_conn import get_mysql_connection
+
+    conn = get_mysql_connection()
+    try:
+        cursor = conn.cursor()
+        for column, kind in (("client_id", "client"), ("rm_name", "rm"), ("stock_name", "stock")):
+            cursor.execute(f"SELECT DISTINCT {column} FROM transactions WHERE {column} IS NOT NULL")
+            index.add_many((value, kind, value) for (value,) in cursor.fetchall())
+        cursor.close()
+    finally:
+        conn.close()
+
+
+def load_clients(index: EntityIndex, clients: Iterable[dict]) -> None:
+    """Index client documents: names and ids resolve to client_id, rm_id to itself"""
+    entries = []
+    for client in clients:
+        if client.get("client_id"):
+            entries.append((client["client_id"], "client", client["client_id"]))
+            if client.get("name"):
+                entries.append((client["name"], "client", client["client_id"]))
+        if client.get("rm_id"):
+            entries.append((client["rm_id"], "rm_id", client["rm_id"]))
+        if client.get("rm_name"):
+            entries.append((client["rm_name"], "rm", client["rm_name"]))
+    index.add_many(entries)
+
+
+def refresh(index: EntityIndex, clients: Iterable[dict] = ()) -> None:
+    """(Re)load every source; safe to call repeatedly since adds are idempotent"""
+    load_clients(index, clients)
+    try:
+        load_mysql(index)
+    except Exception as e:
+        logger.error(f"Could not load entity names from MySQL: {str(e)}")
+    logger.info(f"Entity index holds {len(index)} names")
+
+
+entity_index = EntityIndex()
@@ -0,0 +1,186 @@
+# services/examples.py
+
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services import metrics
+from services.entity_index import entity_index
+from services.single_flight import normalize_question
+
+logger = logging.getLogger(__name__)
+
+SEED_PATH = os.getenv("SQL_EXAMPLES_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                                        "data", "sql_examples.jsonl"))
+LEARNED_PATH = os.getenv("SQL_EXAMPLES_LEARNED_PATH", "logs/sql_examples_learned.jsonl")
+TOP_K = int(os.getenv("SQL_EXAMPLES_TOP_K", "3"))
+MIN_SCORE = float(os.getenv("SQL_EXAMPLES_MIN_SCORE", "0.2"))
+MAX_LEARNED = int(os.getenv("SQL_EXAMPLES_MAX_LEARNED", "2000"))
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9_<>]+")
+STOP_WORDS = set("a an the of in on for to by is are was were me my our us show give tell list what which who "
+                 "how do does please".split())
+
+
+def _terms(text: str) -> List[str]:
+    """Unigrams plus bigrams of a question whose entity names are replaced by their kind"""
+    entities = entity_index.extract(text)
+    for entity in sorted(entities, key=lambda e: e["start"], reverse=True):
+        text = text[:entity["start"]] + f" <{entity['kind']}> " + text[entity["start"] + len(entity["text"]):]
+    words = [w for w in TOKEN_PATTERN.findall(text.lower()) if w not in STOP_WORDS]
+    # Digits become one token and a plural "s" is dropped so "top 5 clients" matches "top 3 client"
+    words = ["<n>" if w.isdigit() else w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w
+             for w in words]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class ExampleStore:
+    """Verified question -> SQL pairs searched by TF-IDF cosine similarity.
+
+    Questions are embedded as TF-IDF vectors over unigrams and bigrams, with
+    client/stock/RM names masked so "holders of TCS" and "holders of INFY"
+    look alike. Term counts are kept sparse as parallel (example, term,
+    count) arrays that a new pair only appends to; weights and norms are
+    recomputed over those entries on the next search, and scoring is one
+    np.bincount. Pairs that run cleanly are learned into LEARNED_PATH, which
+    is rewritten once superseded lines make up half of it.
+    """
+
+    def __init__(self, seed_path: str = SEED_PATH, learned_path: str = LEARNED_PATH):
+        self.seed_path = seed_path
+        self.learned_path = learned_path
+        self.examples: List[dict] = []
+        self._by_question: Dict[str, int] = {}
+        self._vocabulary: Dict[str, int] = {}
+        # Sparse term counts: entry i says example _rows[i] has term _cols[i] _counts[i] times
+        self._rows: List[int] = []
+        self._cols: List[int] = []
+        self._counts: List[float] = []
+        self._weights: Optional[tuple] = None
+        self._learned = 0
+        self._learned_lines = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self) -> None:
+        for path in (self.seed_path, self.learned_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        example = json.loads(line)
+                    except ValueError:
+                        continue
+                    if example.get("question") and example.get("sql"):
+                        self._insert(example)
+                        if path == self.learned_path:
+                            self._learned_lines += 1
+        self._loaded = True
+        logger.info(f"Loaded {len(self.examples)} SQL examples")
+
+    def _insert(self, example: dict) -> bool:
+        key = normalize_question(example["question"])
+        index = self._by_question.get(key)
+        if index is not None:
+            # Verified pairs are never replaced by learned ones; the question's terms are unchanged
+            if self.examples[index].get("source") == "verified":
+                return False
+            self.examples[index] = example
+            return True
+        index = self._by_question[key] = len(self.examples)
+        self.examples.append(example)
+        if example.get("source") == "learned":
+            self._learned += 1
+        for term, count in Counter(_terms(example["question"])).items():
+            self._rows.append(index)
+            self._cols.append(self._vocabulary.setdefault(term, len(self._vocabulary)))
+            self._counts.append(count)
+        self._weights = None
+        metrics.set_gauge("sql_examples.size", len(self.examples))
+        return True
+
+    def _index(self) -> tuple:
+        """(rows, cols, L2-normalised TF-IDF weights, idf) for the current examples"""
+        if self._weights is None:
+            rows = np.array(self._rows, dtype=np.int64)
+            cols = np.array(self._cols, dtype=np.int64)
+            n = len(self.examples)
+            frequency = np.bincount(cols, minlength=len(self._vocabulary))
+            idf = np.log((1 + n) / (1 + frequency)) + 1
+            weights = np.array(self._counts, dtype=np.float64) * idf[cols]
+            norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=n))
+            self._weights = (rows, cols, weights / np.where(norms == 0, 1, norms)[rows], idf)
+        return self._weights
+
+    def search(self, question: str, k: int = TOP_K, min_score: float = MIN_SCORE) -> List[Tuple[float, dict]]:
+        """The k stored examples most similar to the question, best first"""
+        terms = Counter(_terms(question))
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            rows, cols, weights, idf = self._index()
+            vocabulary_size = len(idf)
+            query = [(self._vocabulary[t], c) for t, c in terms.items() if t in self._vocabulary]
+            examples = list(self.examples)
+        if not examples or not query:
+            return []
+        vector = np.zeros(vocabulary_size)
+        for index, count in query:
+            vector[index] = count * idf[index]
+        vector /= np.linalg.norm(vector)
+        scores = np.bincount(rows, weights=weights * vector[cols], minlength=len(examples))
+        top = np.argsort(-scores)[:k]
+        found = [(float(scores[i]), examples[i]) for i in top if scores[i] >= min_score]
+        metrics.increment("sql_examples.hits" if found else "sql_examples.misses")
+        return found
+
+    def learn(self, question: str, sql: str) -> bool:
+        """Remember a question whose SQL ran successfully"""
+        sql = " ".join(sql.split())
+        example = {"question": question.strip(), "sql": sql, "source": "learned"}
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            existing = self._by_question.get(normalize_question(question))
+            if existing is not None and self.examples[existing]["sql"] == sql:
+                return False
+            if existing is None and self._learned >= MAX_LEARNED:
+                return False
+            if not self._insert(example):
+                return False
+            self._persist(example)
+        metrics.increment("sql_examples.learned")
+        return True
+
+    def _persist(self, example: dict) -> None:
+        """Append a learned pair, rewriting the file when replaced pairs make up half of it"""
+        try:
+            os.makedirs(os.path.dirname(self.learned_path) or ".", exist_ok=True)
+            if self._learned_lines + 1 > 2 * self._learned:
+                learned = [e for e in self.examples if e.get("source") == "learned"]
+                temporary = f"{self.learned_path}.tmp"
+                with open(temporary, "w", encoding="utf-8") as f:
+                    f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in learned)
+                os.replace(temporary, self.learned_path)
+                self._learned_lines = len(learned)
+            else:
+                with open(self.learned_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(example, ensure_ascii=False) + "\n")
+                self._learned_lines += 1
+        except OSError as e:
+            logger.error(f"Failed to persist learned SQL example: {str(e)}")
+
+
+def format_examples(found: List[Tuple[float, dict]]) -> str:
+    """Render examples for an LLM prompt"""
+    return "\n\n".join(f"Question: {e['question']}\nSQL: {e['sql']}" for _, e in found)
+
+
+example_store = ExampleStore()
@@ -0,0 +1,239 @@
+# services/export.py
+
+import csv
+import io
+import json
+import logging
+import os
+import threading
+from itertools import chain
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "10000"))
+MAX_EXECUTION_MS = int(os.getenv("EXPORT_MAX_EXECUTION_MS", "600000"))
+MAX_ESTIMATED_ROWS = float(os.getenv("EXPORT_MAX_ESTIMATED_ROWS", "100000000"))
+
+# format -> (media type, file extension)
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+_database = None
+_database_lock = threading.Lock()
+
+
+class ExportError(Exception):
+    """Raised when an answer can't be exported in the requested way"""
+
+
+def _get_database():
+    """One guarded SQLDatabase for exports, reflected on first use"""
+    global _database
+    with _database_lock:
+        if _database is None:
+            from db.sql_guard import GuardedSQLDatabase
+
+            _database = GuardedSQLDatabase.from_uri(os.getenv("MYSQL_URI"))
+        return _database
+
+
+# ---- row sources ------------------------------------------------------------
+
+def _mysql_chunks(sql: str) -> Iterator[List[dict]]:
+    """Stream rows off an unbuffered mysql.connector cursor.
+
+    SQLAlchemy's mysqlconnector dialect has no server-side cursors and
+    buffers the whole result on execute, ignoring stream_results. An
+    unbuffered cursor reads rows off the socket as fetchmany asks for them.
+    The connection is unpooled: one abandoned mid-stream still has unread
+    rows and can't be reused.
+    """
+    from db.mysql_conn import get_mysql_connection
+
+    conn = get_mysql_connection(pool_name=None, pool_size=None)
+    try:
+        cursor = conn.cursor(buffered=False, dictionary=True)
+        cursor.execute(sql)
+        while True:
+            batch = cursor.fetchmany(CHUNK_ROWS)
+            if not batch:
+                break
+            yield batch
+    finally:
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Closing export connection failed: {str(e)}")
+
+
+def sql_chunks(sql: str) -> Iterator[List[dict]]:
+    """Run a read-only query without buffering its result, yielding CHUNK_ROWS rows at a time"""
+    from sqlalchemy import text
+
+    db = _get_database()
+    # Same vetting as the agent's queries, minus the row cap an answer needs
+    prepared = db.guard.prepare(sql, apply_limit=False, max_estimated_rows=MAX_ESTIMATED_ROWS,
+                                max_execution_ms=MAX_EXECUTION_MS)
+    if db.dialect == "mysql":
+        yield from _mysql_chunks(prepared)
+        return
+    with db._engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=CHUNK_ROWS).execute(text(prepared))
+        columns = list(result.keys())
+        while True:
+            batch = result.fetchmany(CHUNK_ROWS)
+            if not batch:
+                break
+            yield [dict(zip(columns, row)) for row in batch]
+
+
+def mongo_chunks(query: Dict[str, Any], collection) -> Iterator[List[dict]]:
+    """Stream a Mongo find() in batches"""
+    cursor = collection.find(query, {"_id": 0}, batch_size=CHUNK_ROWS)
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= CHUNK_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def row_chunks(rows: List[dict]) -> Iterator[List[dict]]:
+    for start in range(0, len(rows), CHUNK_ROWS):
+        yield rows[start:start + CHUNK_ROWS]
+
+
+# ---- encoders ---------------------------------------------------------------
+
+def _flat(row: dict) -> dict:
+    """Nested Mongo values become JSON strings so every format gets flat columns"""
+    return {k: json.dumps(v, default=str) if isinstance(v, (dict, list)) else v for k, v in row.items()}
+
+
+def encode_csv(chunks: Iterable[List[dict]]) -> Iterator[bytes]:
+    columns = None
+    for chunk in chunks:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if columns is None:
+            columns = list(chunk[0].keys())
+            writer.writerow(columns)
+        writer.writerows([[_flat(row).get(c) for c in columns] for row in chunk])
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file that hands back what was written since the last drain.
+
+    It keeps counting the absolute position, which the Parquet writer needs
+    for its footer offsets, while holding only the newest bytes in memory.
+    """
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def encode_arrow(chunks: Iterable[List[dict]], fmt: str) -> Iterator[bytes]:
+    """Arrow IPC stream or Parquet, one record batch / row group per chunk"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ChunkSink()
+    stream = pa.PythonFile(sink, mode="w")
+    writer, schema = None, None
+    for chunk in chunks:
+        table = pa.Table.from_pylist([_flat(row) for row in chunk], schema=schema)
+        if writer is None:
+            schema = table.schema
+            writer = pa.ipc.new_stream(stream, schema) if fmt == "arrow" else pq.ParquetWriter(stream, schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def encode(chunks: Iterable[List[dict]], fmt: str) -> Iterator[bytes]:
+    if fmt == "csv":
+        return encode_csv(chunks)
+    return encode_arrow(chunks, fmt)
+
+
+def _counted(chunks: Iterator[List[dict]]) -> Iterator[List[dict]]:
+    rows = 0
+    try:
+        for chunk in chunks:
+            rows += len(chunk)
+            yield chunk
+    finally:
+        metrics.increment("export.rows", rows)
+        logger.info(f"Exported {rows} rows")
+
+
+def open_export(route: str, query: Any, fmt: str, rows: Optional[List[dict]] = None,
+                collection=None) -> Iterator[bytes]:
+    """Byte stream of an answer's rows in `fmt`.
+
+    SQL answers re-run their query. Mongo answers export the rows kept with
+    them: the recorded filter leaves out top-N sorting and limits, so it is
+    only re-run against a real collection when the rows were too many to
+    keep. Follow-up refinements and analytics answers export their rows too.
+    The first chunk is fetched here so query errors surface before the
+    response starts streaming.
+    """
+    if fmt not in FORMATS:
+        raise ExportError(f"Unsupported format '{fmt}', expected one of {', '.join(FORMATS)}")
+    if fmt != "csv":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportError(f"{fmt} export needs pyarrow installed")
+
+    if route == "sql" and isinstance(query, str):
+        chunks = sql_chunks(query)
+    elif rows:
+        chunks = row_chunks(rows)
+    elif route == "mongo" and collection is not None and isinstance(query, dict) \
+            and not {"refine", "analytics"} & query.keys():
+        chunks = mongo_chunks(query, collection)
+    else:
+        raise ExportError("This answer has no query or rows to export")
+
+    first = next(chunks, None)
+    if first is None:
+        raise ExportError("The query returned no rows")
+    metrics.increment(f"export.{fmt}")
+    return encode(_counted(chain([first], chunks)), fmt)
@@ -0,0 +1,544 @@
+# services/holdings.py
+
+import datetime
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from services import metrics
+from services.change_tracker import ENABLED as CHANGE_TRACKING_ENABLED, ID_COLUMN, ChangeSet, change_tracker
+from services.entity_index import bind_parameters, describe_parameters, entity_index
+from services.tracing import record_query, record_rows
+
+logger = logging.getLogger(__name__)
+
+GROUP_COLUMNS = ("client_id", "stock_name", "rm_name")
+FREQUENCIES = ("day", "week", "month", "quarter", "year")
+LOAD_BATCH = 50000
+# Without change tracking the arrays only see writes through a reload
+RELOAD_SECONDS = float(os.getenv("HOLDINGS_RELOAD_SECONDS", "300"))
+
+
+def _bucket_ids(dates: np.ndarray, freq: str) -> np.ndarray:
+    """Integer period index of each date; consecutive periods differ by one"""
+    if freq == "day":
+        return dates.astype(np.int64)
+    if freq == "week":
+        # Day 0 (1970-01-01) is a Thursday; shift so weeks start on Monday
+        return (dates.astype(np.int64) + 3) // 7
+    if freq == "month":
+        return dates.astype("datetime64[M]").astype(np.int64)
+    if freq == "quarter":
+        return dates.astype("datetime64[M]").astype(np.int64) // 3
+    if freq == "year":
+        return dates.astype("datetime64[Y]").astype(np.int64)
+    raise ValueError(f"Unsupported frequency '{freq}', expected one of {', '.join(FREQUENCIES)}")
+
+
+def _bucket_start(bucket: int, freq: str) -> str:
+    """ISO date of the first day of a period index"""
+    if freq == "day":
+        day = np.datetime64(bucket, "D")
+    elif freq == "week":
+        day = np.datetime64(bucket * 7 - 3, "D")
+    elif freq == "month":
+        day = np.datetime64(bucket, "M").astype("datetime64[D]")
+    elif freq == "quarter":
+        day = np.datetime64(bucket * 3, "M").astype("datetime64[D]")
+    else:
+        day = np.datetime64(bucket, "Y").astype("datetime64[D]")
+    return str(day)
+
+
+class _Snapshot:
+    """Immutable column arrays; readers work on one without holding the lock"""
+
+    def __init__(self, codes: Dict[str, np.ndarray], dates: np.ndarray, amounts: np.ndarray):
+        self.codes = codes
+        self.dates = dates
+        self.amounts = amounts
+
+    def __len__(self):
+        return len(self.amounts)
+
+
+class HoldingsStore:
+    """Columnar copy of transactions for cumulative holdings analytics.
+
+    Client ids, stocks and RMs are dictionary-encoded into integer arrays
+    next to the dates and amounts, so a running total, period-over-period
+    change or concentration figure is one masked np.bincount (plus cumsum)
+    over the whole table. New transactions are buffered and appended on the
+    next read; a change the tracker can't attribute to rows reloads the
+    table in the background. Changes seen while a load is reading the
+    table are held back and replayed once it swaps in.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        self.loaded = False
+        self._reloading = False
+        self._loading = False
+        # Inserts reported during a load, and whether an untracked change needs another one
+        self._backlog: List[dict] = []
+        self._reload_after = False
+
+    def _reset(self) -> None:
+        self._keys: Dict[str, Dict[str, int]] = {c: {} for c in GROUP_COLUMNS}
+        self._names: Dict[str, List[str]] = {c: [] for c in GROUP_COLUMNS}
+        self._snapshot = _Snapshot(
+            {c: np.empty(0, dtype=np.int32) for c in GROUP_COLUMNS},
+            np.empty(0, dtype="datetime64[D]"),
+            np.empty(0, dtype=np.float64)
+        )
+        # (codes, dates, amounts) array batches not yet concatenated
+        self._pending: List[tuple] = []
+        # Highest transaction id already held, so replayed changes aren't counted twice
+        self.max_id: Optional[int] = None
+
+    def _code(self, column: str, name) -> int:
+        key = str(name).strip().lower()
+        code = self._keys[column].get(key)
+        if code is None:
+            code = self._keys[column][key] = len(self._names[column])
+            self._names[column].append(str(name).strip())
+        return code
+
+    def add_rows(self, rows: List[dict]) -> int:
+        """Buffer new transactions; they are folded into the arrays on the next read"""
+        with self._lock:
+            return self._add_locked(rows)
+
+    def _add_locked(self, rows: List[dict]) -> int:
+        kept = []
+        for row in rows:
+            row_id = row.get("id", row.get(ID_COLUMN))
+            if row_id is not None and self.max_id is not None and row_id <= self.max_id:
+                continue
+            if row.get("amount_invested") is None or not row.get("date_"):
+                continue
+            kept.append(row)
+            if row_id is not None:
+                self.max_id = max(self.max_id or 0, row_id)
+        if not kept:
+            return 0
+
+        dates = np.array([str(r["date_"])[:10] for r in kept], dtype="datetime64[D]")
+        amounts = np.array([r["amount_invested"] for r in kept], dtype=np.float64)
+        codes = {c: np.array([self._code(c, r.get(c) or "") for r in kept], dtype=np.int32)
+                 for c in GROUP_COLUMNS}
+        valid = ~np.isnat(dates) & np.isfinite(amounts)
+        self._pending.append(({c: v[valid] for c, v in codes.items()}, dates[valid], amounts[valid]))
+        return int(valid.sum())
+
+    def snapshot(self) -> _Snapshot:
+        with self._lock:
+            if self._pending:
+                pending, self._pending = self._pending, []
+                current = self._snapshot
+                self._snapshot = _Snapshot(
+                    {c: np.concatenate([current.codes[c]] + [p[0][c] for p in pending]) for c in GROUP_COLUMNS},
+                    np.concatenate([current.dates] + [p[1] for p in pending]),
+                    np.concatenate([current.amounts] + [p[2] for p in pending])
+                )
+                metrics.set_gauge("holdings.rows", len(self._snapshot))
+            return self._snapshot
+
+    def name(self, column: str, code: int) -> str:
+        return self._names[column][code]
+
+    # ---- loading ----------------------------------------------------------
+
+    def load_mysql(self) -> None:
+        """Replace the arrays with a full read of the transactions table"""
+        from db.mysql_conn import get_mysql_connection
+
+        fresh = HoldingsStore()
+        with self._lock:
+            self._loading = True
+        try:
+            self._read_table(fresh, get_mysql_connection())
+        except Exception:
+            with self._lock:
+                # Keep serving the old arrays, with what arrived meanwhile
+                backlog, self._backlog = self._backlog, []
+                if self.loaded:
+                    self._add_locked(backlog)
+                self._loading = False
+            raise
+
+        with self._lock:
+            self._keys, self._names = fresh._keys, fresh._names
+            self._snapshot, self.max_id = fresh.snapshot(), fresh.max_id
+            self._pending = []
+            # Inserts seen since the SELECT started; rows it already read are skipped by id
+            backlog, self._backlog = self._backlog, []
+            self._add_locked(backlog)
+            self._loading = False
+            reload_again, self._reload_after = self._reload_after, False
+        self.loaded = True
+        metrics.set_gauge("holdings.rows", len(self.snapshot()))
+        logger.info(f"Holdings analytics loaded {len(self._snapshot)} transactions")
+        if reload_again:
+            self._reload_in_background()
+
+    @staticmethod
+    def _read_table(fresh: "HoldingsStore", conn) -> None:
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                f"SELECT {ID_COLUMN} AS id, client_id, stock_name, rm_name, amount_invested, date_ "
+                f"FROM transactions ORDER BY {ID_COLUMN}"
+            )
+            while True:
+                batch = cursor.fetchmany(LOAD_BATCH)
+                if not batch:
+                    break
+                fresh.add_rows(batch)
+            cursor.close()
+        finally:
+            conn.close()
+
+    def on_change(self, changes: ChangeSet) -> None:
+        """Change-tracker listener: append inserted rows, reload on untracked changes"""
+        if changes.source != "sql":
+            return
+        with self._lock:
+            if self._loading:
+                if changes.full:
+                    self._reload_after = True
+                else:
+                    self._backlog.extend(changes.rows)
+                return
+            if not self.loaded:
+                # The first load will read these rows itself
+                return
+            if not changes.full:
+                self._add_locked(changes.rows)
+                return
+        self._reload_in_background()
+
+    def _reload_in_background(self) -> None:
+        if self._reloading:
+            return
+        self._reloading = True
+
+        def reload():
+            try:
+                self.load_mysql()
+            except Exception as e:
+                logger.error(f"Holdings reload failed: {str(e)}")
+            finally:
+                self._reloading = False
+
+        threading.Thread(target=reload, name="holdings-reload", daemon=True).start()
+
+    # ---- queries ----------------------------------------------------------
+
+    def _mask(self, snap: _Snapshot, filters: Optional[Dict[str, List[str]]],
+              start: Optional[str], end: Optional[str]) -> np.ndarray:
+        mask = np.ones(len(snap), dtype=bool)
+        for column, values in (filters or {}).items():
+            if column not in GROUP_COLUMNS or not values:
+                continue
+            codes = [self._keys[column].get(str(v).strip().lower(), -1) for v in values]
+            mask &= np.isin(snap.codes[column], codes)
+        if start:
+            mask &= snap.dates >= np.datetime64(start, "D")
+        if end:
+            mask &= snap.dates <= np.datetime64(end, "D")
+        return mask
+
+    def _group_index(self, snap: _Snapshot, mask: np.ndarray, group_by: Optional[str]):
+        if group_by is None:
+            return np.array([-1]), np.zeros(int(mask.sum()), dtype=np.int64)
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f"Unsupported grouping '{group_by}', expected one of {', '.join(GROUP_COLUMNS)}")
+        return np.unique(snap.codes[group_by][mask], return_inverse=True)
+
+    def _period_totals(self, group_by, freq, filters, start, end):
+        """(group codes, first bucket, totals[group, period]) plus the opening balance per group"""
+        snap = self.snapshot()
+        mask = self._mask(snap, filters, start, end)
+        if not mask.any():
+            return None
+        buckets = _bucket_ids(snap.dates[mask], freq)
+        first = int(buckets.min())
+        buckets -= first
+        periods = int(buckets.max()) + 1
+
+        groups, inverse = self._group_index(snap, mask, group_by)
+        totals = np.bincount(inverse * periods + buckets, weights=snap.amounts[mask],
+                             minlength=len(groups) * periods).reshape(len(groups), periods)
+
+        # Holdings built up before the window count towards the running total
+        opening = np.zeros(len(groups))
+        if start:
+            before = self._mask(snap, filters, None, None) & (snap.dates < np.datetime64(start, "D"))
+            if before.any():
+                if group_by is None:
+                    opening[0] = snap.amounts[before].sum()
+                else:
+                    codes = snap.codes[group_by][before]
+                    position = np.searchsorted(groups, codes)
+                    held = (position < len(groups)) & (groups[np.minimum(position, len(groups) - 1)] == codes)
+                    opening = np.bincount(position[held], weights=snap.amounts[before][held], minlength=len(groups))
+        return groups, first, totals, opening
+
+    def _label(self, group_by: Optional[str], code: int) -> str:
+        return "All" if group_by is None else self.name(group_by, int(code))
+
+    def cumulative(self, group_by: Optional[str] = None, freq: str = "month",
+                   filters: Optional[Dict[str, List[str]]] = None,
+                   start: Optional[str] = None, end: Optional[str] = None) -> dict:
+        """Per-period invested amounts and their running total, per group"""
+        result = {"group_by": group_by, "freq": freq, "periods": [], "series": []}
+        computed = self._period_totals(group_by, freq, filters, start, end)
+        if computed is None:
+            return result
+        groups, first, totals, opening = computed
+        running = opening[:, None] + np.cumsum(totals, axis=1)
+        result["periods"] = [_bucket_start(first + i, freq) for i in range(totals.shape[1])]
+        order = np.argsort(-running[:, -1], kind="stable")
+        result["series"] = [
+            {
+                "group": self._label(group_by, groups[g]),
+                "opening": round(float(opening[g]), 2),
+                "period_totals": np.round(totals[g], 2).tolist(),
+                "running_total": np.round(running[g], 2).tolist(),
+            }
+            for g in order
+        ]
+        return result
+
+    def period_over_period(self, period: str = "month", group_by: Optional[str] = None,
+                           filters: Optional[Dict[str, List[str]]] = None,
+                           start: Optional[str] = None, end: Optional[str] = None) -> dict:
+        """Invested amount per period with the absolute and relative change on the previous one"""
+        result = {"group_by": group_by, "period": period, "periods": [], "series": []}
+        computed = self._period_totals(group_by, period, filters, start, end)
+        if computed is None:
+            return result
+        groups, first, totals, _ = computed
+        previous = np.concatenate([np.full((len(groups), 1), np.nan), totals[:, :-1]], axis=1)
+        change = totals - previous
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct = np.where(previous > 0, change / previous * 100, np.nan)
+
+        def clean(values):
+            return [None if np.isnan(v) else round(float(v), 2) for v in values]
+
+        result["periods"] = [_bucket_start(first + i, period) for i in range(totals.shape[1])]
+        order = np.argsort(-totals.sum(axis=1), kind="stable")
+        result["series"] = [
+            {
+                "group": self._label(group_by, groups[g]),
+                "totals": np.round(totals[g], 2).tolist(),
+                "change": clean(change[g]),
+                "change_pct": clean(pct[g]),
+            }
+            for g in order
+        ]
+        return result
+
+    def concentration(self, by: str = "stock_name", filters: Optional[Dict[str, List[str]]] = None,
+                      start: Optional[str] = None, end: Optional[str] = None, top: int = 5) -> dict:
+        """Share of the invested total held by each group, top-k share and Herfindahl index"""
+        if by not in GROUP_COLUMNS:
+            raise ValueError(f"Unsupported grouping '{by}', expected one of {', '.join(GROUP_COLUMNS)}")
+        snap = self.snapshot()
+        mask = self._mask(snap, filters, start, end)
+        totals = np.bincount(snap.codes[by][mask], weights=snap.amounts[mask], minlength=len(self._names[by]))
+        total = float(totals.sum())
+        result = {"by": by, "total": round(total, 2), "hhi": None, "top_share": None, "holdings": []}
+        if total <= 0:
+            return result
+        held = np.flatnonzero(totals > 0)
+        order = held[np.argsort(-totals[held], kind="stable")]
+        shares = totals[order] / total
+        result["hhi"] = round(float(np.sum(shares ** 2)), 4)
+        result["top_share"] = round(float(shares[:top].sum()), 4)
+        result["holdings"] = [
+            {"name": self.name(by, int(code)), "amount": round(float(totals[code]), 2), "share": round(float(s), 4)}
+            for code, s in zip(order, shares)
+        ]
+        return result
+
+
+# ---- question fast path ----------------------------------------------------
+
+RUNNING_PATTERN = re.compile(r"\b(cumulative|running total|grown|growth|grow|built up|over time)\b")
+PERIOD_PATTERN = re.compile(
+    r"\b(month over month|mom|quarter over quarter|qoq|year over year|yoy|period over period|"
+    r"compared (?:to|with) (?:the )?(?:last|previous|prior))\b"
+)
+CONCENTRATION_PATTERN = re.compile(r"\b(concentrat\w*|diversif\w*|share of|hhi|herfindahl)\b")
+GROUP_PATTERN = re.compile(r"\b(?:per|by|for each|each|across)\s+(clients?|stocks?|rms?|relationship managers?)\b")
+FREQ_PATTERN = re.compile(
+    r"\b(daily|weekly|monthly|quarterly|yearly|annual(?:ly)?|"
+    r"(?:by|per|each|every) (day|week|month|quarter|year))\b"
+)
+WINDOW_PATTERN = re.compile(r"\b(this|last) (year|quarter|month)\b")
+
+# Words a fast-path question may contain besides the recognised parts
+FILLER = set("""
+show me give list tell what how much is are was were has have had been be did do does the a an of in on for to
+by from since with and all my our firm s total totals invested investing investment investments amount amounts
+value values holding holdings portfolio portfolios money trend change changes changed breakdown view see
+""".split())
+
+GROUP_WORDS = {"client": "client_id", "stock": "stock_name", "rm": "rm_name", "relationship manager": "rm_name"}
+FREQ_WORDS = {"daily": "day", "weekly": "week", "monthly": "month", "quarterly": "quarter",
+              "yearly": "year", "annual": "year", "annually": "year"}
+PERIOD_WORDS = {"mom": "month", "qoq": "quarter", "yoy": "year"}
+
+
+def _window(question: str, today: datetime.date):
+    """Date range for 'this year', 'last month' and the like"""
+    match = WINDOW_PATTERN.search(question)
+    if not match:
+        return None, None
+    which, unit = match.groups()
+    if unit == "year":
+        year = today.year - (which == "last")
+        return datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+    months = 3 if unit == "quarter" else 1
+    first_month = (today.month - 1) // months * months
+    start = datetime.date(today.year, first_month + 1, 1)
+    if which == "last":
+        index = today.year * 12 + first_month - months
+        start = datetime.date(index // 12, index % 12 + 1, 1)
+    index = start.year * 12 + start.month - 1 + months
+    end = datetime.date(index // 12, index % 12 + 1, 1) - datetime.timedelta(days=1)
+    return start, end
+
+
+def _money(value: float) -> str:
+    return f"{value:,.2f}"
+
+
+def answer(question: str, store: Optional[HoldingsStore] = None,
+           today: Optional[datetime.date] = None) -> Optional[str]:
+    """Answer running-total, period-over-period and concentration questions
+    from the in-memory arrays; None when the question isn't one of those"""
+    # Without change tracking the shared arrays may miss writes, so leave answers to SQL
+    if store is None and not CHANGE_TRACKING_ENABLED:
+        return None
+    store = store or holdings
+    if not store.loaded:
+        return None
+    text = question.lower()
+    running, period, concentration = (RUNNING_PATTERN.search(text), PERIOD_PATTERN.search(text),
+                                      CONCENTRATION_PATTERN.search(text))
+    if not (running or period or concentration):
+        return None
+
+    entities = entity_index.extract(question)
+    filters = {c: v for c, v in bind_parameters(entities).items() if c in GROUP_COLUMNS}
+    # "share of ... in TCS" asks for TCS's share of the total, not the split inside TCS
+    if concentration and concentration.group(1) == "share of" and filters:
+        return None
+    group_match = GROUP_PATTERN.search(text)
+    group_by = GROUP_WORDS[group_match.group(1).rstrip("s")] if group_match else None
+    freq_match = FREQ_PATTERN.search(text)
+    freq = (freq_match.group(2) or FREQ_WORDS[freq_match.group(1)]) if freq_match else "month"
+    window = WINDOW_PATTERN.search(text)
+
+    # Anything left that isn't filler ("which RM", "most") asks for more than these figures
+    leftover = text
+    for part in [e["text"].lower() for e in entities] + [m.group(0) for m in
+                 (running, period, concentration, group_match, freq_match, window) if m]:
+        leftover = leftover.replace(part, " ")
+    if any(word not in FILLER for word in re.findall(r"[a-z_]+", leftover)):
+        return None
+
+    start, end = _window(text, today or datetime.date.today())
+    start, end = (start.isoformat() if start else None), (end.isoformat() if end else None)
+    scope = describe_parameters(filters) or "all transactions"
+
+    if concentration:
+        by = group_by or ("stock_name" if "client_id" in filters else "client_id")
+        result = store.concentration(by, filters, start, end)
+        record_query({"analytics": "concentration", "by": by, "filters": filters, "start": start, "end": end}, result)
+        if not result["holdings"]:
+            return f"No investments found for {scope}."
+        record_rows([{by: h["name"], "amount_invested": h["amount"], "share": h["share"]} for h in result["holdings"]])
+        lines = [f"Concentration by {by} for {scope}: total invested {_money(result['total'])}, "
+                 f"top {min(5, len(result['holdings']))} hold {result['top_share'] * 100:.1f}%, "
+                 f"Herfindahl index {result['hhi']:.3f}."]
+        lines += [f"- {h['name']}: {_money(h['amount'])} ({h['share'] * 100:.1f}%)" for h in result["holdings"][:10]]
+        return "\n".join(lines)
+
+    if period:
+        unit = PERIOD_WORDS.get(period.group(1), period.group(1).split()[0])
+        freq = unit if unit in FREQUENCIES else freq
+        result = store.period_over_period(freq, group_by, filters, start, end)
+        kind = "period_over_period"
+    else:
+        result = store.cumulative(group_by, freq, filters, start, end)
+        kind = "cumulative"
+    record_query({"analytics": kind, "group_by": group_by, "freq": freq, "filters": filters,
+                  "start": start, "end": end}, result)
+    if not result["series"]:
+        return f"No investments found for {scope}."
+
+    rows, lines = [], []
+    for series in result["series"]:
+        amounts = series["period_totals"] if kind == "cumulative" else series["totals"]
+        for i, day in enumerate(result["periods"]):
+            row = {"date_": day, "amount_invested": amounts[i]}
+            if group_by:
+                row[group_by] = series["group"]
+            if kind == "cumulative":
+                row["running_total"] = series["running_total"][i]
+            rows.append(row)
+    record_rows(rows)
+
+    title = "Cumulative amount invested" if kind == "cumulative" else f"{freq.capitalize()}-over-{freq} invested amount"
+    lines.append(f"{title} for {scope}" + (f" per {group_by}" if group_by else "") + f", by {freq}:")
+    for series in result["series"][:10]:
+        if group_by:
+            lines.append(f"{series['group']}:")
+        if kind == "cumulative" and start and series["opening"]:
+            lines.append(f"- before {start}: {_money(series['opening'])}")
+        for i, day in enumerate(result["periods"]):
+            if kind == "cumulative":
+                if series["period_totals"][i]:
+                    lines.append(f"- {day}: +{_money(series['period_totals'][i])} "
+                                 f"(running total {_money(series['running_total'][i])})")
+            elif series["totals"][i] or series["change"][i]:
+                pct = series["change_pct"][i]
+                change = series["change"][i]
+                delta = "" if change is None else f", change {change:+,.2f}" + (f" ({pct:+.1f}%)" if pct is not None else "")
+                lines.append(f"- {day}: {_money(series['totals'][i])}{delta}")
+    return "\n".join(lines)
+
+
+def start() -> None:
+    """Load the arrays in the background and keep them current.
+
+    With change tracking on, inserts are appended as they are seen.
+    Otherwise the table is re-read every HOLDINGS_RELOAD_SECONDS for the
+    analytics endpoints, and the question fast path stays off.
+    """
+    def load():
+        while True:
+            try:
+                holdings.load_mysql()
+            except Exception as e:
+                logger.error(f"Could not load holdings analytics: {str(e)}")
+            if CHANGE_TRACKING_ENABLED or RELOAD_SECONDS <= 0:
+                return
+            time.sleep(RELOAD_SECONDS)
+
+    change_tracker.subscribe(holdings.on_change)
+    threading.Thread(target=load, name="holdings-load", daemon=True).start()
+
+
+holdings = HoldingsStore()
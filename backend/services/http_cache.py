@@ -0,0 +1,56 @@
+# services/http_cache.py
+
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+from services.single_flight import normalize_question
+
+# How long browsers and proxies may reuse a GET /ask answer without revalidating
+MAX_AGE = int(os.getenv("ASK_CACHE_MAX_AGE", "60"))
+# Responses smaller than this are sent uncompressed
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+
+
+def etag_for(question: str, route: str, payload: dict) -> str:
+    """Weak ETag for a cached answer: the question, route and the answer itself.
+
+    Hashing the answer and chart rather than a data-version token keeps tags
+    honest when data changes without the change tracker noticing; the next
+    computed answer gets a new tag once the old cache entry expires. Weak
+    because the body also carries per-request fields (processing time,
+    session id) and may be gzipped.
+    """
+    content = json.dumps([route, normalize_question(question), payload.get("answer"), payload.get("visualization")],
+                         sort_keys=True, default=str, ensure_ascii=False)
+    return f'W/"{hashlib.sha1(content.encode("utf-8")).hexdigest()[:20]}"'
+
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header names the current tag (weak comparison)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def headers(etag: Optional[str], shared: bool = False) -> Dict[str, str]:
+    """Caching headers for an /ask response.
+
+    POST answers must be revalidated on every use; GET answers for a plain
+    question may be reused for MAX_AGE seconds. Without a tag (failed or
+    session-dependent answers) nothing may be stored.
+    """
+    if etag is None:
+        return {"Cache-Control": "no-store"}
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={MAX_AGE}" if shared else "private, no-cache",
+    }
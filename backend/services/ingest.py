@@ -0,0 +1,241 @@
+# services/ingest.py
+
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+import numpy as np
+
+from services import data_version, metrics
+from services.change_tracker import ChangeSet, change_tracker
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+METHOD = os.getenv("INGEST_METHOD", "executemany")
+MAX_REPORTED_ERRORS = 20
+
+COLUMNS = ["client_id", "stock_name", "amount_invested", "date_", "rm_name"]
+# VARCHAR widths from the transactions table
+MAX_LENGTHS = {"client_id": 30, "stock_name": 50, "rm_name": 50}
+METHODS = ("executemany", "load_data")
+FORMATS = ("csv", "jsonl")
+
+
+class IngestError(Exception):
+    """Raised for an unusable ingest request (bad format, method or header)"""
+
+
+def read_records(stream: TextIO, fmt: str) -> Iterator[dict]:
+    """Yield one dict per CSV row or JSONL line; malformed JSON lines yield {}"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        missing = [c for c in COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            raise IngestError(f"CSV header is missing columns: {', '.join(missing)}")
+        yield from reader
+    elif fmt == "jsonl":
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield record if isinstance(record, dict) else {}
+    else:
+        raise IngestError(f"Unsupported format '{fmt}', expected one of {', '.join(FORMATS)}")
+
+
+def _parse_floats(values: np.ndarray) -> np.ndarray:
+    """Whole-column float conversion, per value only if the chunk has bad cells"""
+    try:
+        return values.astype(np.float64)
+    except ValueError:
+        parsed = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                parsed[i] = float(value)
+            except ValueError:
+                pass
+        return parsed
+
+
+def _parse_dates(values: np.ndarray) -> np.ndarray:
+    """Whole-column ISO date conversion; unparseable cells become NaT"""
+    try:
+        return values.astype("datetime64[D]")
+    except ValueError:
+        parsed = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[D]")
+        for i, value in enumerate(values):
+            try:
+                parsed[i] = np.datetime64(value[:10], "D")
+            except ValueError:
+                pass
+        return parsed
+
+
+def validate_chunk(records: List[dict]):
+    """Validate a chunk column by column.
+
+    Returns (rows, errors): rows are (client_id, stock_name, amount, date,
+    rm_name) tuples ready for the insert, errors are (index, reason) pairs
+    for the records that were rejected.
+    """
+    columns = {
+        c: np.array([("" if r.get(c) is None else str(r.get(c))).strip() for r in records], dtype=str)
+        for c in COLUMNS
+    }
+    valid = np.ones(len(records), dtype=bool)
+    reasons = np.full(len(records), "", dtype=object)
+
+    def reject(mask: np.ndarray, reason: str) -> None:
+        reasons[mask & valid] = reason
+        valid[mask] = False
+
+    for column, width in MAX_LENGTHS.items():
+        lengths = np.char.str_len(columns[column])
+        reject(lengths == 0, f"{column} is empty")
+        reject(lengths > width, f"{column} longer than {width} characters")
+
+    amounts = _parse_floats(np.where(columns["amount_invested"] == "", "nan", columns["amount_invested"]))
+    reject(~np.isfinite(amounts), "amount_invested is not a number")
+
+    dates = _parse_dates(np.where(columns["date_"] == "", "NaT", columns["date_"]))
+    reject(np.isnat(dates), "date_ is not a YYYY-MM-DD date")
+
+    keep = np.flatnonzero(valid)
+    rows = list(zip(
+        columns["client_id"][keep].tolist(),
+        columns["stock_name"][keep].tolist(),
+        amounts[keep].tolist(),
+        dates[keep].astype(str).tolist(),
+        columns["rm_name"][keep].tolist(),
+    ))
+    errors = [(int(i), reasons[i]) for i in np.flatnonzero(~valid)]
+    return rows, errors
+
+
+def _insert_many(cursor, rows: List[tuple]) -> None:
+    # mysql.connector rewrites executemany INSERTs into one multi-row statement
+    cursor.executemany(
+        f"INSERT INTO transactions ({', '.join(COLUMNS)}) VALUES (%s, %s, %s, %s, %s)",
+        rows
+    )
+
+
+def _load_data(cursor, rows: List[tuple]) -> None:
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", newline="", delete=False) as handle:
+        writer = csv.writer(handle, delimiter="\t", lineterminator="\n", quoting=csv.QUOTE_NONE, escapechar="\\")
+        writer.writerows(rows)
+        path = handle.name
+    try:
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE transactions "
+            f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({', '.join(COLUMNS)})",
+            (path,)
+        )
+    finally:
+        os.unlink(path)
+
+
+def _publish(rows: List[tuple]) -> None:
+    """Tell caches and rollups about written rows.
+
+    When the change tracker is polling it will pick the rows up from the
+    id watermark itself, so they are only published here otherwise.
+    """
+    if change_tracker.watermark is not None:
+        return
+    change_tracker.apply(ChangeSet("sql", [dict(zip(COLUMNS, row)) for row in rows]))
+
+
+def ingest(records: Iterable[dict], batch_size: int = BATCH_SIZE, method: str = METHOD,
+           dry_run: bool = False) -> Dict:
+    """Validate and write transaction records in batches of `batch_size`.
+
+    Each batch is committed on its own, so a failure part way through leaves
+    the earlier batches in place; the report says how far it got.
+    """
+    if method not in METHODS:
+        raise IngestError(f"Unsupported method '{method}', expected one of {', '.join(METHODS)}")
+    batch_size = max(1, batch_size)
+
+    report = {"method": method, "batch_size": batch_size, "dry_run": dry_run,
+              "rows_read": 0, "rows_written": 0, "rows_rejected": 0, "batches": 0, "errors": []}
+    conn = None
+    if not dry_run:
+        from db.mysql_conn import get_mysql_connection
+
+        # A pool of its own: pooled connections must all share one config
+        conn = get_mysql_connection(autocommit=False, allow_local_infile=True,
+                                    pool_name="valuefy_ingest_pool", pool_size=2)
+
+    started = time.perf_counter()
+    records = iter(records)
+    try:
+        cursor = conn.cursor() if conn is not None else None
+        while True:
+            chunk = list(islice(records, batch_size))
+            if not chunk:
+                break
+            rows, errors = validate_chunk(chunk)
+            for index, reason in errors:
+                if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                    report["errors"].append({"record": report["rows_read"] + index + 1, "reason": reason})
+            report["rows_read"] += len(chunk)
+            report["rows_rejected"] += len(errors)
+
+            if rows and cursor is not None:
+                (_load_data if method == "load_data" else _insert_many)(cursor, rows)
+                conn.commit()
+                report["rows_written"] += len(rows)
+                _publish(rows)
+            report["batches"] += 1
+        if cursor is not None:
+            cursor.close()
+    except IngestError:
+        if conn is not None:
+            conn.rollback()
+        raise
+    except Exception as e:
+        report["error"] = str(e)
+        logger.error(f"Ingest stopped after {report['rows_written']} rows: {str(e)}")
+        if conn is not None:
+            conn.rollback()
+    finally:
+        if conn is not None:
+            conn.close()
+
+    seconds = time.perf_counter() - started
+    report["seconds"] = round(seconds, 3)
+    processed = report["rows_read"] if dry_run else report["rows_written"]
+    report["rows_per_second"] = round(processed / seconds, 1) if seconds else 0.0
+    report["data_version"] = data_version.get_version("sql")
+    metrics.increment("ingest.rows_written", report["rows_written"])
+    metrics.increment("ingest.rows_rejected", report["rows_rejected"])
+    logger.info(f"Ingested {report['rows_written']}/{report['rows_read']} rows "
+                f"at {report['rows_per_second']} rows/s ({method}, batch {batch_size})")
+    return report
+
+
+def ingest_stream(stream: TextIO, fmt: str, **options) -> Dict:
+    return ingest(read_records(stream, fmt), **options)
+
+
+def ingest_file(path: str, fmt: Optional[str] = None, **options) -> Dict:
+    """Ingest a .csv or .jsonl file ('-' reads stdin); format follows the extension"""
+    if fmt is None:
+        fmt = "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+    if path == "-":
+        return ingest_stream(io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline=""), fmt, **options)
+    with open(path, encoding="utf-8", newline="") as stream:
+        return ingest_stream(stream, fmt, **options)
@@ -0,0 +1,220 @@
+# services/llm_client.py
+
+import importlib.util
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional
+
+import httpx
+import openai
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+
+from services import metrics
+from services.tracing import stage
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TransportError,
+)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when an LLM call could not finish within its deadline"""
+
+
+class LatencyTracker:
+    """Rolling window of recent call latencies used to pick the hedge delay"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct))
+        return ordered[index]
+
+
+class CallPolicy:
+    """Concurrency limit, deadline, retry and hedging rules for LLM calls.
+
+    `call` takes a function of one argument, the seconds left before the
+    deadline, so each attempt can bound its own HTTP timeout.
+    """
+
+    def __init__(self):
+        self._slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+        self._latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY * 2, thread_name_prefix="llm")
+
+    def call(self, fn: Callable[[float], Any], deadline: Optional[float] = None) -> Any:
+        deadline_at = time.monotonic() + (deadline or DEADLINE_SECONDS)
+        last_error = None
+
+        for attempt in range(MAX_RETRIES + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            if not self._slots.acquire(timeout=remaining):
+                metrics.increment("llm.slot_timeouts")
+                break
+            try:
+                metrics.increment("llm.calls")
+                # _hedged owns the slot from here and frees it when the attempt really ends
+                return self._hedged(fn, deadline_at)
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                metrics.increment("llm.retries")
+                logger.warning(f"LLM call failed (attempt {attempt + 1}/{MAX_RETRIES + 1}): {str(e)}")
+
+            # Exponential backoff with full jitter, never sleeping past the deadline
+            backoff = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+            time.sleep(max(0.0, min(backoff, deadline_at - time.monotonic())))
+
+        metrics.increment("llm.failures")
+        if last_error is not None:
+            raise last_error
+        raise DeadlineExceeded(f"LLM call did not complete within {deadline or DEADLINE_SECONDS:.0f}s")
+
+    def _hedged(self, fn: Callable[[float], Any], deadline_at: float) -> Any:
+        """Run one attempt in the slot the caller acquired.
+
+        The slot is released when the attempt's request finishes, not when
+        this returns: a primary that loses to its hedge keeps running in the
+        executor and still counts against MAX_CONCURRENCY.
+        """
+        started = time.monotonic()
+        hedge_after = self._latency.percentile(0.95) if HEDGE_ENABLED else None
+
+        if hedge_after is None:
+            try:
+                result = fn(deadline_at - started)
+            finally:
+                self._slots.release()
+            self._latency.record(time.monotonic() - started)
+            return result
+
+        try:
+            primary = self._executor.submit(fn, deadline_at - started)
+        except BaseException:
+            self._slots.release()
+            raise
+        primary.add_done_callback(lambda _: self._slots.release())
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            self._latency.record(time.monotonic() - started)
+            return primary.result()
+
+        # The primary is slower than p95: race a duplicate against it, but only
+        # if that does not push us over the provider concurrency limit
+        futures = [primary]
+        if self._slots.acquire(blocking=False):
+            metrics.increment("llm.hedges")
+            hedge = self._executor.submit(fn, deadline_at - time.monotonic())
+            hedge.add_done_callback(lambda _: self._slots.release())
+            futures.append(hedge)
+
+        pending = futures
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline_at - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    self._latency.record(time.monotonic() - started)
+                    return future.result()
+                error = future.exception()
+        if error is not None:
+            raise error
+        raise DeadlineExceeded("LLM call did not complete before its deadline")
+
+
+def _build_http_client() -> httpx.Client:
+    """Build the pooled keep-alive client shared by every ChatOpenAI instance"""
+    http2 = importlib.util.find_spec("h2") is not None
+    if not http2:
+        logger.info("h2 not installed, LLM client falling back to HTTP/1.1 keep-alive")
+    return httpx.Client(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(DEADLINE_SECONDS, connect=5.0),
+    )
+
+
+http_client = _build_http_client()
+call_policy = CallPolicy()
+
+
+class ResilientChatOpenAI(ChatOpenAI):
+    """ChatOpenAI whose completions go through the shared CallPolicy.
+
+    Works both for direct `invoke` calls and inside an AgentExecutor, since
+    every LangChain code path ends up in `_generate`.
+    """
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        parent = super(ResilientChatOpenAI, self)._generate
+
+        def attempt(remaining: float):
+            return parent(messages, stop=stop, run_manager=run_manager, timeout=remaining, **kwargs)
+
+        with stage("llm.call"):
+            return call_policy.call(attempt)
+
+
+def get_chat_model(**overrides) -> ChatOpenAI:
+    """Create a chat model that shares the pooled HTTP client and call policy.
+
+    Set OPENAI_BASE_URL to point every agent at a local OpenAI-compatible
+    server (see scripts/fake_openai_server.py).
+    """
+    settings = {
+        "model": os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
+        "temperature": 0,
+        "api_key": os.getenv("OPENAI_API_KEY"),
+        "base_url": os.getenv("OPENAI_BASE_URL") or None,
+        "http_client": http_client,
+        # Retries are handled by CallPolicy so they share one budget and deadline
+        "max_retries": 0,
+        "timeout": DEADLINE_SECONDS,
+        # AgentExecutor would otherwise stream and bypass _generate
+        "disable_streaming": True,
+    }
+    settings.update(overrides)
+    return ResilientChatOpenAI(**settings)
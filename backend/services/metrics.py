@@ -0,0 +1,34 @@
+# services/metrics.py
+
+import threading
+import time
+from typing import Dict, Union
+
+Number = Union[int, float]
+
+_lock = threading.Lock()
+_counters: Dict[str, Number] = {}
+_gauges: Dict[str, Number] = {}
+_started_at = time.time()
+
+
+def increment(name: str, value: Number = 1) -> None:
+    """Increase a monotonically growing counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: Number) -> None:
+    """Record the current value of a point-in-time measurement"""
+    with _lock:
+        _gauges[name] = value
+
+
+def snapshot() -> dict:
+    """Return a copy of all counters and gauges for the /metrics endpoint"""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "uptime_seconds": round(time.time() - _started_at, 2)
+        }
@@ -0,0 +1,259 @@
+# services/profiling.py
+
+import cProfile
+import glob
+import hmac
+import io
+import json
+import logging
+import logging.handlers
+import os
+import pstats
+import random
+import sys
+import threading
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from services.tracing import RequestTrace
+
+logger = logging.getLogger(__name__)
+span_logger = logging.getLogger("spans")
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "logs/profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000
+# Fraction of ordinary requests whose stage spans are logged, and where
+SPAN_LOG_SAMPLE_RATE = float(os.getenv("SPAN_LOG_SAMPLE_RATE", "0.01"))
+SPAN_LOG_PATH = os.getenv("SPAN_LOG_PATH", "logs/spans.jsonl")
+SPAN_LOG_MAX_BYTES = int(os.getenv("SPAN_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_TOKEN_HEADER = "X-Profile-Token"
+# Shared secret that lets a caller profile its own request; unset, the header is ignored
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+MODES = ("cprofile", "sample")
+
+_current: ContextVar[Optional["ProfileRequest"]] = ContextVar("current_profile", default=None)
+_armed: List[str] = []
+_armed_lock = threading.Lock()
+_span_log_lock = threading.Lock()
+
+
+class ProfileRequest:
+    """What to capture for one request: a profile (mode) and/or stage spans"""
+
+    def __init__(self, mode: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:16] if mode else None
+        self.mode = mode
+        self.profiler: Optional[cProfile.Profile] = None
+        self.stacks: Optional[Counter] = None
+
+
+def arm(count: int = 1, mode: str = "cprofile") -> int:
+    """Profile the next `count` /ask requests; returns how many are now armed"""
+    if mode not in MODES:
+        raise ValueError(f"Unsupported profile mode '{mode}', expected one of {', '.join(MODES)}")
+    with _armed_lock:
+        _armed.extend([mode] * max(0, count))
+        return len(_armed)
+
+
+def for_request(header: Optional[str], token: Optional[str] = None) -> Optional[ProfileRequest]:
+    """Decide what to capture for a request; None (the common case) captures nothing.
+
+    A slot armed via the admin endpoint, or an X-Profile header ("1"/
+    "cprofile" or "sample") sent with an X-Profile-Token matching
+    PROFILE_TOKEN, profiles the request. Profiled requests skip the answer
+    cache, so the header alone is not enough. Otherwise a small random
+    sample of requests only records stage spans for the span log.
+    """
+    mode = None
+    if header and not (PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN)):
+        header = None
+    if header:
+        mode = header.strip().lower()
+        mode = mode if mode in MODES else "cprofile"
+    elif _armed:
+        with _armed_lock:
+            mode = _armed.pop(0) if _armed else None
+    if mode:
+        return ProfileRequest(mode)
+    if SPAN_LOG_SAMPLE_RATE and random.random() < SPAN_LOG_SAMPLE_RATE:
+        return ProfileRequest()
+    return None
+
+
+@contextmanager
+def activate(request: Optional[ProfileRequest]):
+    """Make a profile request current so worker threads started inside see it"""
+    token = _current.set(request)
+    try:
+        yield request
+    finally:
+        _current.reset(token)
+
+
+def _span_log() -> logging.Logger:
+    """The span logger, given a rotating JSON-lines file at SPAN_LOG_PATH on first use.
+
+    Nothing else configures logging (uvicorn only sets up its own loggers),
+    so at the default WARNING level the sampled spans would be dropped.
+    """
+    with _span_log_lock:
+        if not span_logger.handlers:
+            os.makedirs(os.path.dirname(SPAN_LOG_PATH) or ".", exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(SPAN_LOG_PATH, maxBytes=SPAN_LOG_MAX_BYTES,
+                                                           backupCount=5, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            span_logger.addHandler(handler)
+            span_logger.setLevel(logging.INFO)
+            span_logger.propagate = False
+    return span_logger
+
+
+def current() -> Optional[ProfileRequest]:
+    return _current.get()
+
+
+class _Sampler(threading.Thread):
+    """Samples one thread's Python stack every SAMPLE_INTERVAL into folded stacks"""
+
+    def __init__(self, thread_id: int, stacks: Counter):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.stacks = stacks
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+
+@contextmanager
+def capture():
+    """Profile the block on this thread if the current request asked for it"""
+    request = _current.get()
+    if request is None or request.mode is None:
+        yield
+        return
+    if request.mode == "cprofile":
+        request.profiler = cProfile.Profile()
+        request.profiler.enable()
+        try:
+            yield
+        finally:
+            request.profiler.disable()
+    else:
+        request.stacks = Counter()
+        sampler = _Sampler(threading.get_ident(), request.stacks)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stopped.set()
+            sampler.join()
+
+
+def folded_spans(spans: List[tuple]) -> List[str]:
+    """Stage spans as folded stacks weighted by self time in microseconds"""
+    totals: Dict[str, float] = defaultdict(float)
+    for path, _, ms in spans:
+        totals[path] += ms
+    children: Dict[str, float] = defaultdict(float)
+    for path, ms in totals.items():
+        if ";" in path:
+            children[path.rsplit(";", 1)[0]] += ms
+    lines = []
+    for path, ms in totals.items():
+        self_us = int(round(max(ms - children.get(path, 0.0), 0.0) * 1000))
+        if self_us:
+            lines.append(f"{path} {self_us}")
+    return lines
+
+
+def _prune() -> None:
+    summaries = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")), key=os.path.getmtime)
+    for summary in summaries[:-PROFILE_KEEP] if PROFILE_KEEP else []:
+        for path in glob.glob(summary[:-len(".json")] + ".*"):
+            os.remove(path)
+
+
+def finish(request: Optional[ProfileRequest], trace: RequestTrace) -> None:
+    """Store the profile artifacts and/or log the sampled spans of a finished request"""
+    if request is None:
+        return
+    spans = trace.spans or []
+    if request.mode is None:
+        try:
+            _span_log()
+        except OSError as e:
+            logger.error(f"Failed to open span log: {str(e)}")
+            return
+        span_logger.info(json.dumps({
+            "q": trace.question, "route": trace.route, "total_ms": trace.elapsed_ms(),
+            "spans": [{"stage": path, "start_ms": start, "ms": ms} for path, start, ms in spans]
+        }, separators=(",", ":"), ensure_ascii=False))
+        return
+
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, request.id)
+        summary = {
+            "id": request.id, "ts": round(trace.started, 3), "q": trace.question, "route": trace.route,
+            "mode": request.mode, "total_ms": trace.elapsed_ms(), "stages": trace.stages,
+            "spans": [{"stage": path, "start_ms": start, "ms": ms} for path, start, ms in spans],
+            "artifacts": {"spans": f"{request.id}.spans.folded"}
+        }
+        with open(f"{base}.spans.folded", "w", encoding="utf-8") as f:
+            f.write("\n".join(folded_spans(spans)) + "\n")
+
+        if request.profiler is not None:
+            request.profiler.dump_stats(f"{base}.prof")
+            text = io.StringIO()
+            pstats.Stats(request.profiler, stream=text).sort_stats("cumulative").print_stats(25)
+            summary["top_functions"] = text.getvalue()
+            summary["artifacts"]["cprofile"] = f"{request.id}.prof"
+        if request.stacks:
+            with open(f"{base}.folded", "w", encoding="utf-8") as f:
+                f.write("\n".join(f"{stack} {count}" for stack, count in request.stacks.items()) + "\n")
+            summary["artifacts"]["stacks"] = f"{request.id}.folded"
+
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, default=str)
+        _prune()
+        logger.info(f"Stored {request.mode} profile {request.id} for: {trace.question}")
+    except OSError as e:
+        logger.error(f"Failed to store profile: {str(e)}")
+
+
+def list_profiles() -> List[dict]:
+    """Summaries of stored profiles, newest first"""
+    profiles = []
+    for path in sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")), key=os.path.getmtime, reverse=True):
+        try:
+            with open(path, encoding="utf-8") as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        profiles.append({k: summary.get(k) for k in ("id", "ts", "q", "route", "mode", "total_ms", "artifacts")})
+    return profiles
+
+
+def artifact_path(profile_id: str, artifact: str) -> Optional[str]:
+    """Path of a stored artifact ('summary', 'spans', 'cprofile' or 'stacks')"""
+    suffix = {"summary": ".json", "spans": ".spans.folded", "cprofile": ".prof", "stacks": ".folded"}.get(artifact)
+    if suffix is None or not profile_id.isalnum():
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id + suffix)
+    return path if os.path.exists(path) else None
@@ -0,0 +1,100 @@
+# services/query_log.py
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import List, Optional
+
+from services.single_flight import normalize_question
+from services.tracing import RequestTrace
+
+logger = logging.getLogger(__name__)
+
+LOG_PATH = os.getenv("QUERY_LOG_PATH", "logs/ask_log.jsonl")
+MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+BACKUP_COUNT = int(os.getenv("QUERY_LOG_BACKUPS", "5"))
+
+_lock = threading.Lock()
+
+
+def _rotate() -> None:
+    """Shift ask_log.jsonl -> .1 -> .2 ... dropping the oldest backup"""
+    for i in range(BACKUP_COUNT - 1, 0, -1):
+        src = f"{LOG_PATH}.{i}"
+        if os.path.exists(src):
+            os.replace(src, f"{LOG_PATH}.{i + 1}")
+    os.replace(LOG_PATH, f"{LOG_PATH}.1")
+
+
+def append(trace: RequestTrace, cached: bool = False, coalesced: bool = False,
+           follow_up: Optional[str] = None) -> None:
+    """Append one compact JSON line describing an /ask request.
+
+    `follow_up` is "refined" or "contextualized" when the question only made
+    sense within its session; the trace then holds the effective question.
+    """
+    entry = {
+        "ts": round(trace.started, 3),
+        "q": trace.question,
+        "route": trace.route,
+        "query": trace.generated_query,
+        "stages": trace.stages,
+        "total_ms": trace.elapsed_ms(),
+        "rows": trace.result_rows,
+        "bytes": trace.result_bytes,
+        "cached": cached,
+        "coalesced": coalesced,
+        "follow_up": follow_up,
+        "failed": trace.failed
+    }
+    line = json.dumps(entry, separators=(",", ":"), ensure_ascii=False, default=str) + "\n"
+
+    try:
+        with _lock:
+            os.makedirs(os.path.dirname(LOG_PATH) or ".", exist_ok=True)
+            if os.path.exists(LOG_PATH) and os.path.getsize(LOG_PATH) + len(line) > MAX_BYTES:
+                _rotate()
+            with open(LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError as e:
+        # The log is best-effort and must never fail a request
+        logger.error(f"Failed to write query log: {str(e)}")
+
+
+def read_entries(since: Optional[float] = None):
+    """Yield log entries from the rotated backups (oldest first) and the live file"""
+    backups = sorted(glob.glob(f"{LOG_PATH}.*"), key=lambda p: int(p.rsplit(".", 1)[-1]), reverse=True)
+    for path in backups + [LOG_PATH]:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if since is None or entry.get("ts", 0) >= since:
+                    yield entry
+
+
+def top_questions(k: int = 20, days: Optional[float] = 7) -> List[dict]:
+    """Return the K most frequently asked standalone (question, route) pairs"""
+    since = time.time() - days * 86400 if days else None
+    counts = Counter()
+    spelling = {}
+    for entry in read_entries(since):
+        # Session follow-ups can't be replayed out of context
+        if entry.get("failed") or entry.get("follow_up") or not entry.get("q"):
+            continue
+        key = (normalize_question(entry["q"]), entry.get("route"))
+        counts[key] += 1
+        spelling.setdefault(key, entry["q"])
+
+    return [
+        {"question": spelling[key], "route": key[1], "count": count}
+        for key, count in counts.most_common(k)
+    ]
@@ -0,0 +1,237 @@
+# services/refine.py
+
+import re
+from typing import Any, Dict, List, Optional
+
+from services.entity_index import bind_parameters, entity_index
+from services.sessions import SessionState
+from services.visualization import to_date, to_number, pick_date_column, pick_value_column
+
+# Words that mark a question as building on the previous answer
+FOLLOW_UP_CUES = re.compile(
+    r"^(now|and|but|also|then|what about|how about)\b|"
+    r"\b(that|those|these|them|it|only|just|instead|same)\b"
+)
+# Stronger cues that the question can't stand on its own without the previous one
+REFERENCE_CUES = re.compile(
+    r"^(now|and|but|also|then|what about|how about)\b|\b(that|those|these|them|instead|same)\b"
+)
+
+LIMIT_PATTERN = re.compile(r"\b(top|first|bottom|last|lowest|highest)\s+(\d+)\b")
+SORT_PATTERN = re.compile(
+    r"\b(?:sort|sorted|order|ordered|rank|ranked)\s+(?:(?:it|that|them|those|these|the results?)\s+)?by\s+"
+    r"(?:the\s+)?([a-z_ ]+?)(?:\s+(asc|ascending|desc|descending|lowest first|highest first|"
+    r"smallest first|largest first|oldest first|newest first|latest first))?(?=$|[,.!?]| and\b| then\b)"
+)
+COMPARE_PATTERN = re.compile(
+    r"\b(above|over|more than|greater than|at least|below|under|less than|at most)\s+"
+    r"(?:rs\.?\s*|inr\s*|₹\s*)?([\d,]+(?:\.\d+)?)\s*(k|thousand|lakh|lakhs|l|cr|crore|crores|m|mn|million)?\b"
+)
+MULTIPLIERS = {"k": 1e3, "thousand": 1e3, "lakh": 1e5, "lakhs": 1e5, "l": 1e5,
+               "cr": 1e7, "crore": 1e7, "crores": 1e7, "m": 1e6, "mn": 1e6, "million": 1e6}
+
+# Words a follow-up may contain besides the recognised operations
+FILLER = set("""
+now and but also then what how about only just the a an for of in on with to by from me show give list
+that those these them it its same instead please results result rows row ones one filter filtered keep
+limit sort sorted order ordered rank ranked asc ascending desc descending lowest highest smallest largest
+first oldest newest latest where whose who which is are was were investments investment amount amounts
+""".split())
+
+SORT_WORDS = {
+    "amount": "__value__", "value": "__value__", "investment": "__value__", "invested": "__value__",
+    "total": "__value__", "size": "__value__",
+    "date": "__date__", "time": "__date__", "recency": "__date__",
+    "name": "__name__", "client": "client_id", "client id": "client_id", "stock": "stock_name",
+    "rm": "rm_name", "manager": "rm_name", "relationship manager": "rm_name",
+}
+NAME_COLUMNS = ["name", "rm_name", "stock_name", "client_id"]
+
+
+def is_follow_up(question: str) -> bool:
+    return bool(FOLLOW_UP_CUES.search(question.lower()))
+
+
+def contextualize(question: str, state: Optional[SessionState]) -> str:
+    """Rewrite a follow-up the rows can't answer into a self-contained question"""
+    if state is None or not REFERENCE_CUES.search(question.lower()):
+        return question
+    return f"{state.question} (follow-up: {question})"
+
+
+def _resolve_column(word: str, rows: List[dict]) -> Optional[str]:
+    sample = rows[0]
+    word = word.strip()
+    if word in sample:
+        return word
+    target = SORT_WORDS.get(word) or SORT_WORDS.get(word.rstrip("s"))
+    if target == "__value__":
+        return pick_value_column(rows)
+    if target == "__date__":
+        return pick_date_column(rows)
+    if target == "__name__":
+        return next((c for c in NAME_COLUMNS if c in sample), None)
+    if target in sample:
+        return target
+    matches = [c for c in sample if word.replace(" ", "_") in c.lower()]
+    return matches[0] if len(matches) == 1 else None
+
+
+def _sort_key(column: str):
+    def key(row):
+        value = row.get(column)
+        number = to_number(value) if not isinstance(value, str) else None
+        if number is not None:
+            return (0, number, "")
+        day = to_date(value)
+        if day is not None:
+            return (0, day.toordinal(), "")
+        return (1 if value is None else 0, 0, str(value).lower())
+    return key
+
+
+def plan(question: str, state: SessionState) -> Optional[Dict[str, Any]]:
+    """Work out filter/sort/limit operations for a follow-up on the session's rows.
+
+    Returns None when the question isn't a follow-up, asks for something
+    other than filtering, sorting or limiting, refers to a column the cached
+    rows don't have, or names an entity that isn't among them ("what about
+    C004?" is a new lookup, not a filter).
+    """
+    text = question.lower().strip()
+    if not is_follow_up(text) or not state.rows:
+        return None
+    rows = state.rows
+    ops: Dict[str, Any] = {"filters": {}, "compare": [], "sort": None, "limit": None}
+    consumed = []
+
+    entities = entity_index.extract(question)
+    consumed.extend(entity["text"].lower() for entity in entities)
+    for column, values in bind_parameters(entities).items():
+        if column not in rows[0]:
+            return None
+        present = {str(row.get(column, "")).lower() for row in rows}
+        if any(str(value).lower() not in present for value in values):
+            return None
+        ops["filters"][column] = list(values)
+
+    for match in COMPARE_PATTERN.finditer(text):
+        value_column = pick_value_column(rows)
+        if value_column is None:
+            return None
+        word, number, unit = match.groups()
+        threshold = float(number.replace(",", "")) * MULTIPLIERS.get(unit or "", 1)
+        op = ">=" if word == "at least" else "<=" if word == "at most" else \
+            ">" if word in ("above", "over", "more than", "greater than") else "<"
+        ops["compare"].append((value_column, op, threshold))
+        consumed.append(match.group(0))
+
+    sort = SORT_PATTERN.search(text)
+    if sort:
+        column = _resolve_column(sort.group(1), rows)
+        if column is None:
+            return None
+        direction = sort.group(2) or ""
+        descending = direction.startswith(("desc", "highest", "largest", "newest", "latest")) or (
+            not direction and column == pick_value_column(rows))
+        ops["sort"] = (column, descending)
+        consumed.append(sort.group(0))
+
+    limit = LIMIT_PATTERN.search(text)
+    if limit:
+        word, count = limit.groups()
+        ops["limit"] = int(count)
+        if ops["sort"] is None or word in ("bottom", "lowest"):
+            value_column = pick_value_column(rows)
+            if value_column is None and word not in ("first", "last"):
+                return None
+            if word in ("top", "highest", "bottom", "lowest"):
+                ops["sort"] = (value_column, word in ("top", "highest"))
+            elif word == "last":
+                ops["tail"] = True
+        consumed.append(limit.group(0))
+
+    if not (ops["filters"] or ops["compare"] or ops["sort"] or ops["limit"]):
+        return None
+
+    # Anything left that isn't filler means the follow-up asks for more than we can do locally
+    leftover = text
+    for part in consumed:
+        leftover = leftover.replace(part, " ")
+    words = re.findall(r"[a-z_]+", leftover)
+    if any(word not in FILLER for word in words):
+        return None
+    # Entity filters that match nothing together point at a new question, not a narrower answer
+    if ops["filters"] and not (ops["compare"] or ops["sort"] or ops["limit"]) and not apply(ops, rows):
+        return None
+    return ops
+
+
+def apply(ops: Dict[str, Any], rows: List[dict]) -> List[dict]:
+    """Run planned operations over the cached rows"""
+    result = rows
+    for column, values in ops["filters"].items():
+        wanted = {str(v).lower() for v in values}
+        result = [r for r in result if str(r.get(column, "")).lower() in wanted]
+    for column, op, threshold in ops["compare"]:
+        def keep(row, column=column, op=op, threshold=threshold):
+            value = to_number(row.get(column))
+            if value is None:
+                return False
+            return {">": value > threshold, ">=": value >= threshold,
+                    "<": value < threshold, "<=": value <= threshold}[op]
+        result = [r for r in result if keep(r)]
+    if ops["sort"]:
+        column, descending = ops["sort"]
+        result = sorted(result, key=_sort_key(column), reverse=descending)
+    if ops["limit"]:
+        result = result[-ops["limit"]:] if ops.get("tail") else result[:ops["limit"]]
+    return list(result)
+
+
+def describe(ops: Dict[str, Any]) -> str:
+    parts = []
+    for column, values in ops["filters"].items():
+        parts.append(f"{column} in ({', '.join(values)})")
+    for column, op, threshold in ops["compare"]:
+        parts.append(f"{column} {op} {threshold:,.0f}")
+    if ops["sort"]:
+        parts.append(f"sorted by {ops['sort'][0]} {'descending' if ops['sort'][1] else 'ascending'}")
+    if ops["limit"]:
+        parts.append(f"{'last' if ops.get('tail') else 'first'} {ops['limit']}")
+    return ", ".join(parts)
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, float):
+        return f"{value:,.2f}"
+    if isinstance(value, int) and not isinstance(value, bool):
+        return f"{value:,}"
+    return str(value)
+
+
+def format_answer(state: SessionState, ops: Dict[str, Any], rows: List[dict], max_lines: int = 20) -> str:
+    if not rows:
+        return f"None of the previous results match ({describe(ops)})."
+    lines = [f"{len(rows)} result{'s' if len(rows) != 1 else ''} from \"{state.question}\" ({describe(ops)}):"]
+    for i, row in enumerate(rows[:max_lines], 1):
+        lines.append(f"{i}. " + ", ".join(f"{k}: {_format_value(v)}" for k, v in row.items()))
+    if len(rows) > max_lines:
+        lines.append(f"... and {len(rows) - max_lines} more")
+    return "\n".join(lines)
+
+
+def refine(question: str, state: Optional[SessionState]) -> Optional[Dict[str, Any]]:
+    """Answer a follow-up from the session's cached rows, or None to run a new query"""
+    if state is None:
+        return None
+    ops = plan(question, state)
+    if ops is None:
+        return None
+    rows = apply(ops, state.rows)
+    return {
+        "answer": format_answer(state, ops, rows),
+        "rows": rows,
+        "query": {"refine": describe(ops), "of": state.query},
+        "ops": ops,
+    }
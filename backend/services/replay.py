@@ -0,0 +1,69 @@
+# services/replay.py
+
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable
+
+from services import metrics, query_log
+
+logger = logging.getLogger(__name__)
+
+REPLAY_TOP_K = int(os.getenv("REPLAY_TOP_K", "20"))
+REPLAY_WINDOW_DAYS = float(os.getenv("REPLAY_WINDOW_DAYS", "7"))
+REPLAY_AT = os.getenv("REPLAY_AT")  # daily local time, e.g. "08:30"
+
+
+def replay_top_questions(compute: Callable[[str, str], Any], k: int = REPLAY_TOP_K) -> dict:
+    """Re-run the most frequent logged questions against fresh data.
+
+    `compute(question, route)` must bypass the answer cache and store the
+    new answer, so this warms the cache before traffic arrives.
+    """
+    start = time.time()
+    hot = query_log.top_questions(k, days=REPLAY_WINDOW_DAYS)
+    refreshed, failed = 0, 0
+
+    for item in hot:
+        try:
+            compute(item["question"], item["route"])
+            refreshed += 1
+        except Exception as e:
+            failed += 1
+            logger.error(f"Replay failed for '{item['question']}': {str(e)}")
+
+    metrics.increment("replay.refreshed", refreshed)
+    metrics.increment("replay.failed", failed)
+    summary = {
+        "questions": len(hot),
+        "refreshed": refreshed,
+        "failed": failed,
+        "duration": f"{time.time() - start:.2f}s"
+    }
+    logger.info(f"Replay finished: {summary}")
+    return summary
+
+
+def _seconds_until(at: str) -> float:
+    hour, minute = (int(part) for part in at.split(":"))
+    now = datetime.datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += datetime.timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+def start_scheduler(compute: Callable[[str, str], Any], at: str = REPLAY_AT) -> None:
+    """Replay the hot questions once a day at REPLAY_AT (disabled when unset)"""
+    if not at:
+        return
+
+    def loop():
+        while True:
+            time.sleep(_seconds_until(at))
+            replay_top_questions(compute)
+
+    threading.Thread(target=loop, name="replay-scheduler", daemon=True).start()
+    logger.info(f"Hot question replay scheduled daily at {at}")
@@ -0,0 +1,68 @@
+# services/sessions.py
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from services import metrics
+
+MAX_SESSIONS = int(os.getenv("SESSION_MAX", "1000"))
+TTL_SECONDS = float(os.getenv("SESSION_TTL", "1800"))
+# Result sets larger than this are not kept for follow-ups
+MAX_ROWS = int(os.getenv("SESSION_MAX_ROWS", "5000"))
+
+
+class SessionState:
+    """The last structured result a session saw and the query that produced it"""
+
+    def __init__(self, question: str, route: str, query: Any, rows: List[dict]):
+        self.question = question
+        self.route = route
+        self.query = query
+        self.rows = rows
+        self.updated = time.time()
+
+
+class SessionStore:
+    """Thread-safe LRU of per-session results, bounded by MAX_SESSIONS and TTL"""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl: float = TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def get(self, session_id: Optional[str]) -> Optional[SessionState]:
+        if not session_id:
+            return None
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                return None
+            if time.time() - state.updated > self.ttl:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return state
+
+    def put(self, session_id: str, question: str, route: str, query: Any, rows: Optional[List[dict]]) -> None:
+        """Remember a result for follow-ups; without usable rows the session is cleared"""
+        with self._lock:
+            if not rows or len(rows) > MAX_ROWS or not isinstance(rows[0], dict):
+                self._sessions.pop(session_id, None)
+            else:
+                self._sessions[session_id] = SessionState(question, route, query, rows)
+                self._sessions.move_to_end(session_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            metrics.set_gauge("sessions.active", len(self._sessions))
+
+
+session_store = SessionStore()
@@ -0,0 +1,70 @@
+# services/single_flight.py
+
+import asyncio
+import logging
+import re
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different spellings share one key"""
+    normalized = re.sub(r'\s+', ' ', question.strip().lower())
+    return normalized.rstrip('?.! ')
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one shared computation.
+
+    The first caller for a key starts the work; callers arriving while it is
+    still running await the same task instead of starting their own. Errors
+    raised by the work are re-raised to every waiter. A waiter being cancelled
+    (e.g. the client disconnected) does not cancel the shared work unless it
+    was the last one still waiting for it.
+    """
+
+    def __init__(self, name: str = "single_flight"):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(fn())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._forget(key, t))
+            metrics.increment(f"{self.name}.executions")
+        else:
+            metrics.increment(f"{self.name}.suppressed")
+            logger.info(f"Joining in-flight computation for {key!r}")
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters.get(key) == 1 and not task.done():
+                logger.info(f"Last waiter for {key!r} cancelled, cancelling shared work")
+                task.cancel()
+            raise
+        finally:
+            if key in self._waiters and self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._waiters.pop(key, None)
+        # Mark the exception as retrieved; waiters get it through shield()
+        if not task.cancelled() and task.exception() is not None:
+            metrics.increment(f"{self.name}.errors")
+
+    def is_in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
@@ -0,0 +1,117 @@
+# services/tracing.py
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("current_trace", default=None)
+
+
+class RequestTrace:
+    """Per-request record of stage latencies and what the agent executed"""
+
+    def __init__(self, question: str, route: Optional[str] = None, record_spans: bool = False):
+        self.question = question
+        self.route = route
+        self.started = time.time()
+        self._clock = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        # (stage path, start ms, duration ms) per stage, only for profiled or sampled requests
+        self.spans: Optional[List[tuple]] = [] if record_spans else None
+        self._path: List[str] = []
+        self.generated_query: Optional[Any] = None
+        self.result_rows: Optional[int] = None
+        self.result_bytes: Optional[int] = None
+        # Structured rows behind the answer, used for chart series
+        self.rows: Optional[List[dict]] = None
+        self.failed: Optional[str] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        spans = self.spans
+        if spans is not None:
+            self._path.append(name)
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.stages[name] = round(self.stages.get(name, 0) + elapsed_ms, 2)
+            if spans is not None:
+                spans.append((";".join(self._path), round((start - self._clock) * 1000, 2), round(elapsed_ms, 2)))
+                self._path.pop()
+
+    def merge(self, other: Optional["RequestTrace"]) -> None:
+        """Fold the stages and results recorded by a shared agent computation in"""
+        if other is None:
+            return
+        for name, ms in other.stages.items():
+            self.stages[name] = round(self.stages.get(name, 0) + ms, 2)
+        self.generated_query = other.generated_query
+        self.result_rows = other.result_rows
+        self.result_bytes = other.result_bytes
+        self.rows = other.rows
+        self.failed = other.failed
+        if self.spans is not None and other.spans:
+            # Nest the agent's spans under whatever stage this trace is in
+            prefix = "".join(f"{name};" for name in self._path)
+            offset = (other._clock - self._clock) * 1000
+            self.spans.extend((prefix + path, round(start + offset, 2), ms) for path, start, ms in other.spans)
+
+    def elapsed_ms(self) -> float:
+        return round((time.time() - self.started) * 1000, 2)
+
+
+@contextmanager
+def start_trace(question: str, route: Optional[str] = None, record_spans: bool = False):
+    """Make a new trace current for the code running inside the block"""
+    trace = RequestTrace(question, route, record_spans)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def get_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block against the current trace; a no-op outside a request"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+def record_query(query: Any, result: Any = None, rows: Optional[int] = None) -> None:
+    """Record the generated SQL/Mongo query and the size of what it returned"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    trace.generated_query = query
+    if rows is not None:
+        trace.result_rows = rows
+    if result is not None:
+        trace.result_bytes = len(str(result).encode("utf-8"))
+
+
+def record_rows(rows: List[dict]) -> None:
+    """Keep the structured rows a query returned on the current trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    trace.rows = list(rows)
+    trace.result_rows = len(trace.rows)
+
+
+def mark_failed(reason: str) -> None:
+    """Flag the current request's answer as an error so it is not cached"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.failed = reason
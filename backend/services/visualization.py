@@ -0,0 +1,162 @@
+# services/visualization.py
+
+import datetime
+import os
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+MAX_POINTS = int(os.getenv("VIZ_MAX_POINTS", "200"))
+TOP_N = int(os.getenv("VIZ_TOP_N", "10"))
+
+# Columns worth a per-group breakdown, in display order
+GROUP_COLUMNS = ['rm_name', 'stock_name', 'name', 'client_id', 'rm_id']
+VALUE_HINTS = ['amount_invested', 'portfolio_value', 'total', 'amount', 'value', 'sum', 'invested']
+
+
+def to_date(value: Any) -> Optional[datetime.date]:
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, str) and len(value) >= 10:
+        try:
+            return datetime.date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+    return None
+
+
+def to_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def pick_value_column(rows: List[dict]) -> Optional[str]:
+    """The numeric column to plot: a known amount column, else the first numeric one"""
+    sample = rows[0]
+    numeric = [c for c, v in sample.items() if to_number(v) is not None and not isinstance(v, str)]
+    for hint in VALUE_HINTS:
+        for column in numeric:
+            if hint in column.lower():
+                return column
+    return numeric[0] if numeric else None
+
+
+def pick_date_column(rows: List[dict]) -> Optional[str]:
+    sample = rows[0]
+    if 'date_' in sample:
+        return 'date_'
+    for column, value in sample.items():
+        if not isinstance(value, (int, float)) and to_date(value) is not None:
+            return column
+    return None
+
+
+def time_buckets(rows: List[dict], date_column: str, value_column: str) -> List[dict]:
+    """Sum values per day, ISO week or month depending on the span of the data"""
+    points = []
+    for row in rows:
+        day = to_date(row.get(date_column))
+        value = to_number(row.get(value_column))
+        if day is not None and value is not None:
+            points.append((day, value))
+    if not points:
+        return []
+
+    span = (max(p[0] for p in points) - min(p[0] for p in points)).days
+    if span <= 92:
+        label = lambda d: d.isoformat()
+    elif span <= 730:
+        label = lambda d: (d - datetime.timedelta(days=d.weekday())).isoformat()
+    else:
+        label = lambda d: d.strftime('%Y-%m')
+
+    totals = defaultdict(float)
+    for day, value in points:
+        totals[label(day)] += value
+    return [{"name": bucket, "value": round(total, 2)} for bucket, total in sorted(totals.items())]
+
+
+def group_totals(rows: List[dict], group_column: str, value_column: Optional[str]) -> List[Tuple[str, float]]:
+    """Sum of value_column (or row count) per group, largest first"""
+    totals = defaultdict(float)
+    for row in rows:
+        key = row.get(group_column)
+        if key is None:
+            continue
+        value = to_number(row.get(value_column)) if value_column else 1.0
+        totals[str(key)] += value or 0.0
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+def top_n_with_other(totals: List[Tuple[str, float]], n: int = TOP_N) -> List[dict]:
+    """Keep the n largest groups and fold the rest into a single 'Other' bucket"""
+    series = [{"name": name, "value": round(value, 2)} for name, value in totals[:n]]
+    rest = sum(value for _, value in totals[n:])
+    if rest:
+        series.append({"name": "Other", "value": round(rest, 2)})
+    return series
+
+
+def lttb(points: Sequence[dict], threshold: int = MAX_POINTS) -> List[dict]:
+    """Largest-Triangle-Three-Buckets downsampling of an ordered series.
+
+    Keeps the first and last points and, from each of threshold-2 buckets,
+    the point forming the largest triangle with its neighbours, which
+    preserves peaks and troughs far better than taking every k-th point.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    values = [p["value"] for p in points]
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_start, next_end = end, min(int((i + 2) * bucket_size) + 1, n)
+        avg_x = (next_start + next_end - 1) / 2
+        avg_y = sum(values[next_start:next_end]) / max(next_end - next_start, 1)
+
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((a - avg_x) * (values[j] - values[a]) - (a - j) * (avg_y - values[a]))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def build_series(rows: Optional[List[dict]]) -> Optional[Dict[str, Any]]:
+    """Chart-ready series computed from an agent's structured result rows"""
+    if not rows or not isinstance(rows[0], dict):
+        return None
+
+    value_column = pick_value_column(rows)
+    series = {}
+
+    date_column = pick_date_column(rows)
+    if date_column and value_column:
+        timeline = time_buckets(rows, date_column, value_column)
+        if len(timeline) > 1:
+            series["timeline"] = lttb(timeline, MAX_POINTS)
+
+    for column in GROUP_COLUMNS:
+        if column in rows[0]:
+            totals = group_totals(rows, column, value_column)
+            if totals:
+                series[f"by_{column}"] = top_n_with_other(totals, TOP_N)
+
+    if not series:
+        return None
+    return {"series": series, "value_field": value_column, "row_count": len(rows)}
@@ -0,0 +1,43 @@
+from services.entity_index import entity_index
+from services.refine import apply, plan
+from services.sessions import SessionState
+
+entity_index.add("C001", "client", "C001")
+entity_index.add("C002", "client", "C002")
+entity_index.add("C004", "client", "C004")
+entity_index.add("TCS", "stock", "TCS")
+
+ROWS = [
+    {"client_id": "C001", "stock_name": "TCS", "amount_invested": 500.0},
+    {"client_id": "C002", "stock_name": "INFY", "amount_invested": 300.0},
+    {"client_id": "C001", "stock_name": "INFY", "amount_invested": 100.0},
+]
+STATE = SessionState("top investments", "sql", "SELECT ...", ROWS)
+
+
+def test_filter_on_an_entity_in_the_rows():
+    ops = plan("now only C001", STATE)
+    assert ops["filters"] == {"client_id": ["C001"]}
+    assert [r["amount_invested"] for r in apply(ops, ROWS)] == [500.0, 100.0]
+
+
+def test_entity_missing_from_the_rows_is_a_new_question():
+    assert plan("what about C004?", STATE) is None
+
+
+def test_filters_matching_nothing_together_are_a_new_question():
+    assert plan("what about C002 and TCS?", STATE) is None
+
+
+def test_top_n_sorts_by_value():
+    ops = plan("just the top 2", STATE)
+    assert [r["amount_invested"] for r in apply(ops, ROWS)] == [500.0, 300.0]
+
+
+def test_compare_filters_on_the_value_column():
+    ops = plan("only those above 200", STATE)
+    assert [r["client_id"] for r in apply(ops, ROWS)] == ["C001", "C002"]
+
+
+def test_unrelated_words_are_not_refined():
+    assert plan("now show their risk appetite", STATE) is None
@@ -0,0 +1,51 @@
+import pytest
+
+from db.sql_guard import DEFAULT_LIMIT, SQLGuard, UnsafeQueryError
+
+
+def guard_with_plan(plan):
+    return SQLGuard(explain=lambda sql: plan)
+
+
+BIG_SCAN = [{"id": 1, "table": "transactions", "rows": 50_000_000, "filtered": 100}]
+
+
+def test_existing_limit_is_kept_on_a_large_scan():
+    sql = guard_with_plan(BIG_SCAN).prepare("SELECT * FROM transactions LIMIT 10")
+    assert "LIMIT 10" in sql
+
+
+def test_oversized_limit_is_capped_on_a_large_scan():
+    sql = guard_with_plan(BIG_SCAN).prepare("SELECT * FROM transactions LIMIT 5000000")
+    assert f"LIMIT {DEFAULT_LIMIT}" in sql
+
+
+def test_unbounded_scan_gets_the_default_limit():
+    sql = guard_with_plan(BIG_SCAN).prepare("SELECT * FROM transactions")
+    assert f"LIMIT {DEFAULT_LIMIT}" in sql
+
+
+def test_full_table_aggregate_is_allowed():
+    sql = guard_with_plan(BIG_SCAN).prepare(
+        "SELECT rm_name, SUM(amount_invested) FROM transactions GROUP BY rm_name")
+    assert "MAX_EXECUTION_TIME" in sql
+
+
+def test_cartesian_join_is_refused():
+    plan = [{"id": 1, "table": "a", "rows": 5_000, "filtered": 100},
+            {"id": 1, "table": "b", "rows": 5_000, "filtered": 100}]
+    with pytest.raises(UnsafeQueryError):
+        guard_with_plan(plan).prepare("SELECT COUNT(*) FROM transactions a, transactions b")
+
+
+def test_row_multiplying_join_is_refused():
+    plan = [{"id": 1, "table": "a", "rows": 5_000, "filtered": 100},
+            {"id": 1, "table": "b", "rows": 5_000, "filtered": 100}]
+    with pytest.raises(UnsafeQueryError):
+        guard_with_plan(plan).prepare(
+            "SELECT COUNT(*) FROM transactions a JOIN transactions b ON a.rm_name = b.rm_name")
+
+
+def test_writes_are_refused():
+    with pytest.raises(UnsafeQueryError):
+        guard_with_plan([]).prepare("DELETE FROM transactions")
@@ -16,6 +16,10 @@ const ChatInterface = () => {
   const [queryType, setQueryType] = useState('');
   const messagesEndRef = useRef(null);
   const inputRef = useRef(null);
+  // Lets the backend answer follow-ups ("just the top 3") from the last result
+  const sessionIdRef = useRef(null);
+  // Last answer and ETag per question, so repeats are revalidated instead of re-downloaded
+  const answersRef = useRef(new Map());
 
   const API_BASE_URL = import.meta.env.VITE_API_URL || "http://localhost:8000";
 
@@ -54,14 +58,26 @@ const ChatInterface = () => {
     setIsTyping(true);
 
     try {
+      const answerKey = inputValue.trim().toLowerCase().replace(/\s+/g, ' ').replace(/[?.! ]+$/, '');
+      const known = answersRef.current.get(answerKey);
       const response = await axios.post(`${API_BASE_URL}/ask`, {
-        question: inputValue
+        question: inputValue,
+        session_id: sessionIdRef.current
       }, {
         timeout: 30000,
         headers: {
           'Content-Type': 'application/json',
-        }
+          ...(known ? { 'If-None-Match': known.etag } : {})
+        },
+        validateStatus: status => (status >= 200 && status < 300) || status === 304
       });
+      if (response.status === 304) {
+        response.data = { ...known.data, session_id: sessionIdRef.current };
+      } else if (response.headers.etag) {
+        answersRef.current.set(answerKey, { etag: response.headers.etag, data: response.data });
+      }
+
+      sessionIdRef.current = response.data.session_id || sessionIdRef.current;
 
       const botMessage = {
         id: Date.now() + 1,
@@ -155,6 +171,8 @@ const ChatInterface = () => {
 
   const clearChat = () => {
     setMessages([]);
+    sessionIdRef.current = null;
+    answersRef.current.clear();
     setShowVisualization(false);
     setVisualizationData(null);
     setQueryType('');
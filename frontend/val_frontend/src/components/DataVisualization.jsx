@@ -67,7 +67,22 @@ const DataVisualization = ({ data, queryType, isLoading }) => {
     let chartData = [];
     let chartConfig = {};
 
-    switch (queryType) {
+    // Prefer the chart-ready series the backend computed from the query results
+    const series = data?.visualization_data?.series;
+    const serverSeries = series && (
+      (chartType === 'line' && series.timeline) ||
+      Object.values(series).find((points) => points.length)
+    );
+
+    if (serverSeries) {
+      chartData = serverSeries;
+      chartConfig = {
+        dataKey: 'value',
+        nameKey: 'name',
+        title: data.visualization_data.query,
+        format: formatCurrency
+      };
+    } else switch (queryType) {
       case 'topPortfolios':
         chartData = sampleData.portfolioAnalysis.slice(0, 5);
         chartConfig = {